@@ -0,0 +1,82 @@
+import base64
+import json
+import random
+import threading
+import time
+
+# A 1x1 PNG, returned for image requests.
+TINY_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGNgYGAAAAAEAAH2FzhVAAAAAElFTkSuQmCC"
+)
+
+WORDS = (
+    "strategy growth roadmap revenue forecast quarter margin pipeline customer retention "
+    "headcount budget launch partnership compliance risk milestone review alignment"
+).split()
+
+
+class _Namespace:
+    def __init__(self, **values):
+        self.__dict__.update(values)
+
+
+class FakeGemini:
+    """A local stand-in for google.genai.Client with configurable latency and failure modes.
+
+    Text requests are answered from the response_schema in the request config. Failures are
+    drawn per call: API errors raise, malformed responses come back truncated or fenced,
+    and partial responses leave out a field so the generator has to re-request it.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, malformed_rate=0.0, partial_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.partial_rate = partial_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.models = _Namespace(generate_content=self.generate_content)
+
+    def __call__(self, api_key=None):
+        """Lets an instance be used as generate_files.client_factory."""
+        return self
+
+    def _value(self, schema, rng):
+        kind = schema["type"]
+        if kind == "STRING":
+            return " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 40))).capitalize()
+        if kind == "ARRAY":
+            return [self._value(schema["items"], rng) for _ in range(rng.randint(3, 6))]
+        if kind == "OBJECT":
+            return {key: self._value(value, rng) for key, value in schema["properties"].items()}
+        raise ValueError(f"Unsupported schema type: {kind}")
+
+    def generate_content(self, model, contents, config=None):
+        with self.lock:
+            self.calls += 1
+            rng = random.Random(self.rng.random())
+            roll = rng.random()
+        delay = self.latency + rng.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        if roll < self.error_rate:
+            raise RuntimeError("503 UNAVAILABLE (simulated)")
+
+        if getattr(config, "response_modalities", None):
+            part = _Namespace(inline_data=_Namespace(data=TINY_PNG), text=None)
+            return _Namespace(candidates=[_Namespace(content=_Namespace(parts=[part]))], text=None, parsed=None)
+
+        schema = getattr(config, "response_schema", None) or {"type": "OBJECT", "properties": {}}
+        content = self._value(schema, rng)
+        # Each response falls in at most one of the error, partial and malformed bands of roll.
+        roll -= self.error_rate
+        partial = roll < self.partial_rate
+        malformed = not partial and roll < self.partial_rate + self.malformed_rate
+        if partial and len(content) > 1:
+            content.pop(rng.choice(sorted(content)))
+        text = json.dumps(content)
+        if malformed:
+            text = rng.choice([f"```json\n{text}\n```", text[: max(1, len(text) * 3 // 4)], text[:-1] + ",}"])
+        return _Namespace(text=text, parsed=None, candidates=[])
@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from generate_all import load_generator_module
+from benchmarks.fake_gemini import FakeGemini
+from benchmarks.synthetic_corpus import write_synthetic_emails_csv
+
+# Multipliers applied to each benchmark's base size.
+SCALES = {"small": 1, "medium": 4, "large": 16}
+
+STAGES = ("org", "calendar", "email", "docs")
+
+
+def measure(fn, repeat):
+    """Runs fn `repeat` times and returns the wall time of each run in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def result(name, scale, params, times, units, unit):
+    """Builds one comparable benchmark result. Throughput is based on the fastest run."""
+    best = min(times)
+    return {
+        "name": name, "scale": scale, "params": params,
+        "seconds": best, "median_seconds": statistics.median(times), "runs": len(times),
+        "units": units, "unit": unit, "throughput": units / best if best else None,
+    }
+
+
+def bench_org(scale_name, factor, repeat, workdir):
+    org = load_generator_module("org")
+    num_users = 10000 * factor
+    config = {
+        "seed": {"value": 0},
+        "users_file": {"value": os.path.join(workdir, "org", "users.csv")},
+        "org": {"num_users": {"value": num_users}},
+    }
+    yield result("org_users", scale_name, {"users": num_users}, measure(lambda: org.synthesize_org(config), repeat), num_users, "users")
+
+
+def bench_calendar(scale_name, factor, repeat, workdir):
+    calendar = load_generator_module("calendar")
+    users = {f"user{i}": [f"User {i}", f"user.{i}"] for i in range(10 * factor)}
+    months = 6 * factor
+    params = {"users": len(users), "months": months, "num_events_range": [20, 40]}
+
+    def definitions():
+        return calendar.generate_event_definitions(
+            users, months, (20, 40), "Benchmark HQ", ["Sync"], ["Focus time"], rng=random.Random(0)
+        )
+
+    events = definitions()
+    yield result("calendar_event_definitions", scale_name, params, measure(definitions, repeat), len(events), "events")
+
+    output_dir = os.path.join(workdir, "calendar")
+    os.makedirs(output_dir, exist_ok=True)
+
+    def write_all():
+        for user_key in users:
+            user_events = [event for event in events if user_key in event["attendees"]]
+            if user_events:
+                cal = calendar.create_calendar_from_definitions(user_events, "example.com", users)
+                calendar.write_to_ics(cal, os.path.join(output_dir, f"{user_key}.ics"))
+
+    yield result("calendar_ics_write", scale_name, params, measure(write_all, repeat), len(users), "files")
+
+
+def bench_email(scale_name, factor, repeat, workdir):
+    email = load_generator_module("email")
+    rows = 2000 * factor
+    csv_path = os.path.join(workdir, f"emails_{rows}.csv")
+    csv_bytes = write_synthetic_emails_csv(csv_path, rows, seed=factor)
+    num_samples = rows // 10
+    params = {"rows": rows, "csv_bytes": csv_bytes, "num_samples": num_samples}
+
+    def sample():
+        return email.get_email_samples(csv_path, num_samples, random.Random(0))
+
+    samples = sample()
+    yield result("email_csv_sampling", scale_name, params, measure(sample, repeat), rows, "rows")
+
+    mbox_path = os.path.join(workdir, "samples.mbox")
+    replacements = [f"user.{i}@example.com" for i in range(10 * factor)]
+
+    def write_mbox():
+        email.create_mbox_from_messages(samples, mbox_path, replacements, [], random.Random(0))
+
+    yield result("email_mbox_write", scale_name, params, measure(write_mbox, repeat), len(samples), "messages")
+
+
+def bench_docs(scale_name, factor, repeat, workdir, fake):
+    docs = load_generator_module("docs")
+    docs.client_factory = fake
+    docs._clients.clear()
+    from faker import Faker
+    faker = Faker()
+    num_files = 5 * factor
+    output_dir = os.path.join(workdir, "docs")
+    os.makedirs(output_dir, exist_ok=True)
+    renderers = {
+        "document": docs.generate_document,
+        "spreadsheet": docs.generate_spreadsheet,
+        "presentation": docs.generate_presentation,
+        "pdf": docs.generate_pdf,
+        "image": lambda user, org, path, f, content: docs.generate_image_from_api(content.get("image_prompt"), path, api_key="benchmark"),
+    }
+
+    for file_type, render in renderers.items():
+        params = {"files": num_files, "llm_latency": fake.latency, "llm_error_rate": fake.error_rate,
+                  "llm_malformed_rate": fake.malformed_rate, "llm_partial_rate": fake.partial_rate}
+        contents = []
+
+        def content():
+            contents.clear()
+            rng = random.Random(0)
+            for _ in range(num_files):
+                contents.append(docs.generate_unique_gemini_content(
+                    "Benchmarking", "CEO", file_type, docs.DEFAULT_DOC_TYPES, docs.DEFAULT_SHEET_TYPES,
+                    docs.DEFAULT_PPT_TYPES, docs.DEFAULT_PDF_TYPES, api_key="benchmark", rng=rng
+                ))
+
+        yield result(f"docs_{file_type}_content", scale_name, params, measure(content, repeat), num_files, "files")
+
+        usable = [c for c in contents if c]
+
+        def render_all():
+            for i, theme_content in enumerate(usable):
+                path = os.path.join(output_dir, f"{file_type}_{i}{docs.FILE_EXTENSIONS[file_type]}")
+                render("bench", "Benchmark Corp", path, faker, theme_content)
+
+        entry = result(f"docs_{file_type}_render", scale_name, params, measure(render_all, repeat), len(usable), "files")
+        entry["params"]["usable_content"] = len(usable)
+        yield entry
+
+
+def compare(results, baseline, tolerance):
+    """Prints a comparison against a baseline and returns the names of regressed benchmarks."""
+    previous = {(r["name"], r["scale"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n{'benchmark':<34} {'scale':<7} {'baseline':>10} {'current':>10} {'change':>8}")
+    for r in results:
+        old = previous.get((r["name"], r["scale"]))
+        if not old or old["params"] != r["params"]:
+            print(f"{r['name']:<34} {r['scale']:<7} {'-':>10} {r['seconds']:>9.4f}s {'new':>8}")
+            continue
+        change = (r["seconds"] - old["seconds"]) / old["seconds"] if old["seconds"] else 0.0
+        flag = ""
+        if change > tolerance:
+            regressions.append(f"{r['name']}[{r['scale']}]")
+            flag = "  REGRESSION"
+        print(f"{r['name']:<34} {r['scale']:<7} {old['seconds']:>9.4f}s {r['seconds']:>9.4f}s {change:>+7.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark each generator stage offline, with a synthetic corpus and a fake Gemini backend.")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Comma-separated stages to benchmark.")
+    parser.add_argument("--scales", default="small,medium", help=f"Comma-separated scales to run ({', '.join(SCALES)}).")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark; the fastest is reported.")
+    parser.add_argument("--output", default="benchmarks/results.json", help="Where to write the JSON results.")
+    parser.add_argument("--compare", help="A previous results file to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Slowdown (as a fraction) that counts as a regression.")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated seconds per Gemini call.")
+    parser.add_argument("--llm-jitter", type=float, default=0.0, help="Extra random seconds (0 to this) per Gemini call.")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fraction of Gemini calls that raise an API error.")
+    parser.add_argument("--llm-malformed-rate", type=float, default=0.0, help="Fraction of Gemini responses with broken JSON.")
+    parser.add_argument("--llm-partial-rate", type=float, default=0.0, help="Fraction of Gemini responses missing a field.")
+    parser.add_argument("--workdir", help="Directory for generated files. Defaults to a temporary directory.")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    scales = [s.strip() for s in args.scales.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES] + [s for s in scales if s not in SCALES]
+    if unknown:
+        print(f"Error: unknown stages or scales: {', '.join(unknown)}")
+        sys.exit(1)
+    if args.llm_error_rate + args.llm_malformed_rate + args.llm_partial_rate > 1:
+        print("Error: the --llm-*-rate options must add up to at most 1.")
+        sys.exit(1)
+    # Read the baseline before anything is written, since --output may be the same file.
+    baseline = None
+    if args.compare:
+        if not os.path.exists(args.compare):
+            print(f"Error: no results file at {args.compare}")
+            sys.exit(1)
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    fake = FakeGemini(args.llm_latency, args.llm_jitter, args.llm_error_rate, args.llm_malformed_rate, args.llm_partial_rate)
+    results = []
+    out = sys.stdout
+    # The generators print progress for every file; keep it out of the results table.
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        workdir = args.workdir or tmp
+        for scale_name in scales:
+            factor = SCALES[scale_name]
+            benches = {
+                "org": lambda: bench_org(scale_name, factor, args.repeat, workdir),
+                "calendar": lambda: bench_calendar(scale_name, factor, args.repeat, workdir),
+                "email": lambda: bench_email(scale_name, factor, args.repeat, workdir),
+                "docs": lambda: bench_docs(scale_name, factor, args.repeat, workdir, fake),
+            }
+            for stage in stages:
+                for entry in benches[stage]():
+                    results.append(entry)
+                    print(f"{entry['name']:<34} {scale_name:<7} {entry['seconds']:>9.4f}s  "
+                          f"{entry['throughput'] or 0:>12,.1f} {entry['unit']}/s", file=out)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
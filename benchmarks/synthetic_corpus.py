@@ -0,0 +1,90 @@
+import argparse
+import csv
+import random
+from datetime import datetime, timedelta
+
+FIRST_NAMES = ["john", "jane", "sally", "mark", "vince", "kay", "louise", "phillip", "tana", "jeff", "sara", "chris"]
+LAST_NAMES = ["arnold", "beck", "dasovich", "germany", "kaminski", "lay", "mann", "shackleton", "skilling", "taylor"]
+SUBJECTS = [
+    "RE: Gas nominations for tomorrow", "FW: Updated curve", "Meeting on Thursday", "Re: contract draft",
+    "Q3 forecast", "", "Fwd: \"urgent\" - please review", "Trading limits, revised", "Lunch?", "RE: RE: deal #4432",
+]
+WORDS = (
+    "the deal desk gas power curve trader position contract please review attached forecast volume "
+    "price schedule counterparty risk limit meeting call tomorrow thanks regards update revised draft "
+    "pipeline capacity storage hedge basis spread settlement invoice legal credit approval"
+).split()
+
+
+def _address(rng):
+    return f"{rng.choice(FIRST_NAMES)}.{rng.choice(LAST_NAMES)}@enron.com"
+
+
+def _body(rng, avg_lines):
+    """A multi-line body with the quoting, commas and forwarded blocks the Enron corpus is full of."""
+    lines = []
+    for _ in range(max(1, int(rng.expovariate(1 / avg_lines)))):
+        line = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 14)))
+        roll = rng.random()
+        if roll < 0.1:
+            line = f'> {line}, "{rng.choice(WORDS)}"'
+        elif roll < 0.15:
+            line = ""
+        lines.append(line)
+    if rng.random() < 0.2:
+        lines += ["", "---------------------- Forwarded by " + _address(rng) + " ----------------------", ""]
+        lines += [f"> {rng.choice(WORDS)} {rng.choice(WORDS)}, {rng.choice(WORDS)}" for _ in range(rng.randint(2, 8))]
+    return "\n".join(lines)
+
+
+def synthetic_message(rng, index, avg_lines=12):
+    """Builds one raw email in the shape of the Enron emails.csv 'message' column."""
+    sender = _address(rng)
+    recipients = ", ".join(_address(rng) for _ in range(rng.randint(1, 4)))
+    sent = datetime(2000, 1, 1) + timedelta(minutes=rng.randint(0, 60 * 24 * 700))
+    headers = [
+        f"Message-ID: <{index}.{rng.randint(10 ** 6, 10 ** 7)}.JavaMail.evans@thyme>",
+        f"Date: {sent.strftime('%a, %d %b %Y %H:%M:%S')} -0700 (PDT)",
+        f"From: {sender}",
+        f"To: {recipients}",
+        f"Subject: {rng.choice(SUBJECTS)}",
+        "Mime-Version: 1.0",
+        "Content-Type: text/plain; charset=us-ascii",
+        "Content-Transfer-Encoding: 7bit",
+        f"X-From: {sender.split('@')[0].replace('.', ' ').title()}",
+        f"X-To: {recipients}",
+        "X-cc: ",
+        "X-bcc: ",
+        "X-Folder: \\Enron\\Notes Folders\\All documents",
+        "X-Origin: Enron",
+        "X-FileName: enron.nsf",
+    ]
+    return "\n".join(headers) + "\n\n" + _body(rng, avg_lines)
+
+
+def write_synthetic_emails_csv(path, num_rows, seed=0, avg_lines=12):
+    """Writes an emails.csv with 'file' and 'message' columns and returns its size in bytes."""
+    rng = random.Random(seed)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "message"])
+        for i in range(num_rows):
+            folder = f"{rng.choice(LAST_NAMES)}-{rng.choice(FIRST_NAMES)[0]}"
+            writer.writerow([f"{folder}/all_documents/{i + 1}.", synthetic_message(rng, i, avg_lines)])
+        return f.tell()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic, Enron-like emails.csv for benchmarks.")
+    parser.add_argument("path", help="Where to write the CSV file.")
+    parser.add_argument("--rows", type=int, default=10000, help="Number of emails to write.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument("--avg-lines", type=int, default=12, help="Average number of body lines per email.")
+    args = parser.parse_args()
+
+    size = write_synthetic_emails_csv(args.path, args.rows, args.seed, args.avg_lines)
+    print(f"Wrote {args.rows} emails ({size / 1e6:.1f} MB) to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,20 @@ from ics import Calendar, Event
 import os
 import pytz
 import argparse
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from orgconfig import get_config_value, load_config, make_config
+from orgdata import get_planned_users, get_users, people_fingerprint
+from sharding import get_shard, shard_summary
+from output_sink import describe_entry, keep_stored, open_sink
+from manifest import derive_seed, section_hash
+from planner import EVENT_FILE_BYTES, EVENT_MEMORY_BYTES, ICS_HEADER_BYTES, USER_MEMORY_BYTES
+import metrics
+
+# No attendee has overlapping events, so only about this many fit in each person's
+# business hours in a month; beyond that each event gives up after max_attempts tries.
+MAX_EVENTS_PER_MONTH = 150
 
 def is_overlapping(start_time, end_time, existing_events):
     """Check if a new event overlaps with any existing events."""
@@ -29,53 +43,69 @@ def is_overlapping(start_time, end_time, existing_events):
             return True
     return False
 
-def generate_event_definitions(users, months, num_events_range, location, shared_event_types, solo_event_types):
-    """Generates a list of event definitions for the given users."""
+def generate_event_definitions(users, months, num_events_range, location, shared_event_types, solo_event_types, rng=random, start_date=None, events_per_user=False):
+    """Generates reproducible event definitions, num_events_range a month for the group (or each user), with no attendee double-booked."""
     user_keys = list(users.keys())
 
-    pacific = pytz.timezone('US/Pacific')
-    start_date = datetime.now(pacific)
+    if start_date is None:
+        start_date = datetime.now(pytz.timezone('US/Pacific'))
     end_date = start_date + timedelta(days=30 * months)
     business_hours = (9, 17)
 
     event_definitions = []
     max_attempts = 1000
+    num_events = rng.randint(*num_events_range) * months
+    if events_per_user:
+        num_events *= len(user_keys)
+    # Each attendee's events by day, so a new event is only checked against its attendees' other events that day.
+    busy = {}
+
+    for _ in range(num_events):
+        if len(user_keys) > 1 and rng.random() < 0.5:
+            attendee_keys = rng.sample(user_keys, 2)
+            user1_name = users[attendee_keys[0]][0]
+            user2_name = users[attendee_keys[1]][0]
+            name = rng.choice(shared_event_types)
+            description = f"{name} for {user1_name} and {user2_name}"
+        else:
+            solo_user_key = rng.choice(user_keys)
+            user_name = users[solo_user_key][0]
+            name = rng.choice(solo_event_types)
+            description = f"{name} for {user_name}"
+            attendee_keys = [solo_user_key]
 
-    for _ in range(random.randint(*num_events_range) * months):
         for attempt in range(max_attempts):
-            event_day = start_date + timedelta(days=random.randint(0, (end_date - start_date).days))
-            if event_day.weekday() >= 5: continue
+            event_day = start_date + timedelta(days=rng.randint(0, (end_date - start_date).days))
+            if event_day.weekday() >= 5:
+                metrics.incr("calendar_weekend_rejections")
+                continue
 
-            start_hour = random.randint(business_hours[0], business_hours[1] - 2)
-            start_time = event_day.replace(hour=start_hour, minute=random.choice([0, 15, 30, 45]), second=0, microsecond=0)
-            duration = random.choice([30, 60, 90, 120])
+            start_hour = rng.randint(business_hours[0], business_hours[1] - 2)
+            start_time = event_day.replace(hour=start_hour, minute=rng.choice([0, 15, 30, 45]), second=0, microsecond=0)
+            duration = rng.choice([30, 60, 90, 120])
             end_time = start_time + timedelta(minutes=duration)
 
             if end_time.hour >= business_hours[1]:
                 end_time = event_day.replace(hour=business_hours[1], minute=0, second=0, microsecond=0)
 
-            if is_overlapping(start_time, end_time, event_definitions): continue
-
-            attendee_keys = []
-            if len(user_keys) > 1 and random.random() < 0.5:
-                attendee_keys = random.sample(user_keys, 2)
-                user1_name = users[attendee_keys[0]][0]
-                user2_name = users[attendee_keys[1]][0]
-                name = random.choice(shared_event_types)
-                description = f"{name} for {user1_name} and {user2_name}"
-            else:
-                solo_user_key = random.choice(user_keys)
-                user_name = users[solo_user_key][0]
-                name = random.choice(solo_event_types)
-                description = f"{name} for {user_name}"
-                attendee_keys = [solo_user_key]
-
-            event_definitions.append({
+            days = [(attendee_key, event_day.date()) for attendee_key in attendee_keys]
+            if any(is_overlapping(start_time, end_time, busy.get(day, ())) for day in days):
+                metrics.incr("calendar_overlap_rejections")
+                continue
+
+            # A seeded UID, so a shared meeting is the same event in every attendee's calendar.
+            event = {
                 "name": name, "description": description, "begin": start_time,
-                "end": end_time, "location": location, "attendees": attendee_keys
-            })
+                "end": end_time, "location": location, "attendees": attendee_keys,
+                "uid": f"{rng.getrandbits(64):016x}"
+            }
+            event_definitions.append(event)
+            for day in days:
+                busy.setdefault(day, []).append(event)
+            metrics.incr("calendar_events_generated")
             break
         else:
+            metrics.incr("calendar_slot_failures")
             print("Warning: Could not find a free slot after max attempts.")
 
     return event_definitions
@@ -90,6 +120,8 @@ def create_calendar_from_definitions(event_definitions, domain, users):
         e.begin = definition["begin"]
         e.end = definition["end"]
         e.location = definition["location"]
+        if "uid" in definition:
+            e.uid = f"{definition['uid']}@{domain}"
 
         for attendee_key in definition["attendees"]:
             full_name, prefix = users[attendee_key]
@@ -106,56 +138,206 @@ def write_to_ics(calendar, filename):
         print(f"No events to write for {filename}.")
         return
 
+    with metrics.timer("calendar_ics_render_seconds"):
+        data = calendar.serialize()
     with open(filename, 'w') as f:
-        f.write(calendar.serialize())
+        f.write(data)
+    metrics.incr("calendar_files_written")
+    metrics.incr("calendar_bytes_written", len(data.encode('utf-8')))
     print(f"Generated {len(calendar.events)} non-overlapping events and saved to {filename}")
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Generate fake calendar events.")
-    parser.add_argument('--domains', required=True, help='A comma-separated list of domains.')
-    parser.add_argument('--users', required=True, help='A JSON string of users.')
-    parser.add_argument('--months', type=int, default=6, help='Number of months to generate events for.')
-    parser.add_argument('--num-events', default='20,40', help='Comma-separated range for number of events.')
-    parser.add_argument('--location', default='Middle-earth', help='Location for events.')
-    parser.add_argument('--shared-event-types', default='[]', help='JSON list of shared event types.')
-    parser.add_argument('--solo-event-types', default='[]', help='JSON list of solo event types.')
-    parser.add_argument('--output-dir', default='.', help='Directory to save the ics files.')
-    args = parser.parse_args()
+def generate_calendars(config, manifest=None):
+    """Generates a personalized .ics file per user from a parsed config and returns the paths written."""
+    domain = get_config_value(config, "domain")
+    users = get_users(config)
+    if not domain or not users:
+        raise ValueError("'domain' and 'users' (or a users file) must be defined in the config.")
 
-    try:
-        users = json.loads(args.users)
-        shared_event_types = json.loads(args.shared_event_types)
-        solo_event_types = json.loads(args.solo_event_types)
-        num_events_range = tuple(map(int, args.num_events.split(',')))
-    except (json.JSONDecodeError, ValueError) as e:
-        print(f"Error parsing arguments: {e}")
-        exit(1)
+    calendar_config = config.get("calendar", {})
+    months = get_config_value(calendar_config, "months_to_generate", 6)
+    num_events_range = tuple(get_config_value(calendar_config, "num_events_range", [20, 40]))
+    location = get_config_value(calendar_config, "location", "Middle-earth")
+    shared_event_types = get_config_value(calendar_config, "shared_event_types", [])
+    solo_event_types = get_config_value(calendar_config, "solo_event_types", [])
+    output_dir = get_config_value(calendar_config, "output_dir", "output/calendar")
+    # An org's calendars need events in proportion to its size.
+    events_per_user = get_config_value(calendar_config, "events_per_user", "org" in config)
+    configured_start_date = get_config_value(calendar_config, "start_date")
+    shard = get_shard(config)
+    if shard and not configured_start_date:
+        raise ValueError("'calendar.start_date' must be set when sharding, so every shard generates the same events.")
 
-    domains = [d.strip() for d in args.domains.split(',') if d.strip()]
+    domains = [d.strip() for d in domain.split(',') if d.strip()]
+    written = []
+    if not domains:
+        return written
 
-    if domains:
+    configured_seed = get_config_value(config, "seed")
+    base_seed = manifest.base_seed(configured_seed) if manifest else configured_seed
+    config_hash = section_hash(calendar_config, domain, people_fingerprint(users), base_seed, events_per_user)
+    seed = derive_seed(base_seed, "calendar") if base_seed is not None else None
+
+    if configured_start_date:
+        start_date = pytz.timezone('US/Pacific').localize(datetime.fromisoformat(configured_start_date))
+    else:
+        # Without a configured start date, today is used, and kept for as long as the config is
+        # unchanged. It is stored before any file is written, so a run resumed on a later day
+        # generates the same events as the files already written.
+        stored = manifest.meta.get("calendar_start_date") if manifest else None
+        if stored and stored["config_hash"] == config_hash:
+            start_date = datetime.fromisoformat(stored["value"])
+        else:
+            start_date = datetime.now(pytz.timezone('US/Pacific'))
+            if manifest:
+                manifest.set_meta(calendar_start_date={"config_hash": config_hash, "value": start_date.isoformat()})
+    sink = open_sink(calendar_config, "calendar", output_dir, shard)
+    previous = manifest.get("calendar") if manifest else None
+    if previous and previous.get("config_hash") == config_hash:
+        outputs = previous["inputs"]["outputs"]
+        same_shard = previous["inputs"].get("shard") == (str(shard) if shard else None)
+        if previous.get("status") == "ok" and same_shard and all(
+                manifest.is_fresh(artifact_id, config_hash) and sink.holds(f"{artifact_id}.ics", manifest.get(artifact_id))
+                for artifact_id in outputs):
+            sink.close()
+            print("All calendar files are up to date.")
+            return [describe_entry(manifest.get(artifact_id)) for artifact_id in outputs]
+
+    if len(users) <= 10:
         user_names = " and ".join([info[0] for info in users.values()])
-        print(f"\nGenerating one master list of events for {user_names}...")
+    else:
+        user_names = f"{len(users)} users"
+    # Every shard generates the whole master list, so shared meetings match across shards.
+    print(f"\nGenerating one master list of events for {user_names}...")
+    with metrics.timer("calendar_event_generation_seconds"):
         all_event_defs = generate_event_definitions(
-            users, args.months, num_events_range, args.location, shared_event_types, solo_event_types
+            users, months, num_events_range, location, shared_event_types, solo_event_types,
+            rng=random.Random(seed) if seed is not None else random, start_date=start_date,
+            events_per_user=events_per_user
         )
 
-        print("\nCreating a personalized calendar file for each user and domain...")
+    # Index the events by attendee once, rather than scanning every event for every user.
+    events_by_user = {}
+    for event in all_event_defs:
+        for attendee_key in event["attendees"]:
+            events_by_user.setdefault(attendee_key, []).append(event)
+
+    print("\nCreating a personalized calendar file for each user and domain...")
+    outputs = []
+    without_events = 0
+    try:
         for domain in domains:
-            for user_key, user_info in users.items():
-                user_event_defs = [
-                    event for event in all_event_defs if user_key in event["attendees"]
-                ]
+            for user_key in users:
+                user_event_defs = events_by_user.get(user_key)
 
                 if not user_event_defs:
-                    print(f"No events for {user_info[0]} in domain {domain}. Skipping.")
+                    without_events += 1
+                    continue
+                if shard and not shard.owns(user_key):
+                    continue
+
+                name = f"{user_key}_{domain}.ics"
+                artifact_id = f"{user_key}_{domain}"
+                outputs.append(artifact_id)
+                if manifest and manifest.is_fresh(artifact_id, config_hash):
+                    keep_stored(sink, manifest, artifact_id, name)
+                    written.append(sink.describe(name))
+                    print(f"{written[-1]} is up to date.")
+                    metrics.incr("calendar_files_skipped")
                     continue
 
                 calendar = create_calendar_from_definitions(user_event_defs, domain, users)
+                with sink.writer(name) as filename:
+                    write_to_ics(calendar, filename)
+                written.append(sink.describe(name))
+                sink.record(manifest, artifact_id, name, config_hash=config_hash, seed=seed)
+    finally:
+        sink.close()
+
+    if without_events:
+        print(f"Skipped {without_events} calendar files for users without events.")
+    if manifest:
+        total = len(domains) * sum(1 for user_key in users if user_key in events_by_user)
+        manifest.record("calendar", None, config_hash, seed=seed,
+                        inputs={"start_date": start_date.isoformat(), **shard_summary(shard, outputs, total)})
+    print("\nProcess complete.")
+    return written
+
+def plan_calendar(config):
+    """Plans generate_calendars' events and files; the event count is exact when seeded."""
+    users = get_planned_users(config)
+    calendar_config = config.get("calendar", {})
+    months = get_config_value(calendar_config, "months_to_generate", 6)
+    num_events_range = tuple(get_config_value(calendar_config, "num_events_range", [20, 40]))
+    domains = [d.strip() for d in (get_config_value(config, "domain") or "").split(',') if d.strip()]
+    shard = get_shard(config)
+
+    seed = get_config_value(config, "seed")
+    if seed is not None:
+        requested = random.Random(derive_seed(seed, "calendar")).randint(*num_events_range) * months
+    else:
+        requested = sum(num_events_range) // 2 * months
+    if get_config_value(calendar_config, "events_per_user", "org" in config):
+        requested *= len(users)
+    # Half of the events are shared by two users when there is more than one.
+    attendees = 1.5 if len(users) > 1 else 1
+    events = min(requested, int(MAX_EVENTS_PER_MONTH * months * max(len(users), 1) / attendees))
+    notes = []
+    if requested > events:
+        notes.append(f"Only about {events} of the {requested} events fit in {months} months without overlaps; "
+                     f"each of the rest is abandoned after 1000 attempts, which is slow.")
+
+    # Users without events get no file.
+    with_events = len(users) * (1 - (1 - attendees / len(users)) ** events) if users else 0
+    owned = sum(1 for user_key in users if shard.owns(user_key)) / len(users) if shard and users else 1
+    files = round(with_events * owned) * len(domains)
+    return {
+        "jobs": {"events": events, "files": files},
+        "work": {"events": events, "files": files},
+        "outputs": {None: {"files": files,
+                           "bytes": files * ICS_HEADER_BYTES + round(events * attendees * owned * len(domains) * EVENT_FILE_BYTES)}},
+        "memory_bytes": events * EVENT_MEMORY_BYTES + len(users) * USER_MEMORY_BYTES,
+        "notes": notes,
+    }
 
-                output_dir = args.output_dir
-                os.makedirs(output_dir, exist_ok=True)
-                filename = os.path.join(output_dir, f"{user_key}_{domain}.ics")
-                write_to_ics(calendar, filename)
+def config_from_args(args):
+    """Builds a config from command-line arguments, layered over --config if given."""
+    config = load_config(args.config) if args.config else {}
+    calendar_config = config.setdefault("calendar", {})
+    if args.domains:
+        config["domain"] = {"value": args.domains}
+    if args.users:
+        config["users"] = {"value": json.loads(args.users)}
+    calendar_config.update(make_config(
+        months_to_generate=args.months,
+        num_events_range=list(map(int, args.num_events.split(','))) if args.num_events else None,
+        location=args.location,
+        shared_event_types=json.loads(args.shared_event_types) if args.shared_event_types else None,
+        solo_event_types=json.loads(args.solo_event_types) if args.solo_event_types else None,
+        output_dir=args.output_dir,
+    ))
+    # Unless the config sets it, the script writes to the current directory as it always has.
+    calendar_config.setdefault("output_dir", {"value": "."})
+    return config
 
-        print("\nProcess complete.")
\ No newline at end of file
+def main():
+    parser = argparse.ArgumentParser(description="Generate fake calendar events.")
+    parser.add_argument('--config', help='Path to a config file. Other arguments override its values.')
+    parser.add_argument('--domains', help='A comma-separated list of domains.')
+    parser.add_argument('--users', help='A JSON string of users.')
+    parser.add_argument('--months', type=int, help='Number of months to generate events for (default 6).')
+    parser.add_argument('--num-events', help='Comma-separated range for number of events (default 20,40).')
+    parser.add_argument('--location', help='Location for events (default Middle-earth).')
+    parser.add_argument('--shared-event-types', help='JSON list of shared event types.')
+    parser.add_argument('--solo-event-types', help='JSON list of solo event types.')
+    parser.add_argument('--output-dir', help='Directory to save the ics files (default the current directory).')
+    args = parser.parse_args()
+
+    try:
+        config = config_from_args(args)
+        generate_calendars(config)
+    except (json.JSONDecodeError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
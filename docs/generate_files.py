@@ -17,6 +17,7 @@ import random
 import json
 import io
 import re
+import sys
 from faker import Faker
 from docx import Document
 import xlsxwriter
@@ -26,49 +27,165 @@ from fpdf import FPDF
 from google import genai
 from google.genai import types
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from orgconfig import get_config_value, load_config, make_config
+from orgdata import get_planned_users, get_role, get_users, org_generates_users
+from sharding import get_shard, shard_summary
+from output_sink import keep_stored, open_sink
+from manifest import derive_seed, section_hash
+from planner import (CHARS_PER_TOKEN, DOCS_FILE_BYTES, DOCS_OUTPUT_TOKENS, DOCS_RENDER_MEMORY_BYTES,
+                     IMAGE_OUTPUT_TOKENS, USER_MEMORY_BYTES)
+import metrics
+
+TEXT_MODEL = "gemini-2.5-flash"
+IMAGE_MODEL = "gemini-2.0-flash-preview-image-generation"
+
+# Defaults used when the config does not override them.
+DEFAULT_ROLES = ["CEO", "CFO", "CTO", "HR_Manager", "Sales_Manager", "Marketing_Manager", "Project_Manager", "Accountant", "Software_Engineer", "Customer_Support_Specialist"]
+DEFAULT_FILE_TYPES = ["document", "spreadsheet", "presentation", "image", "pdf"]
+DEFAULT_DOC_TYPES = [
+    "Internal Memo", "Project Proposal", "Competitive Analysis", "Budget Report", "Meeting Minutes",
+    "Business Requirements Document (BRD)", "Standard Operating Procedure (SOP)", "Marketing Plan",
+    "Sales Strategy", "Quarterly Business Review (QBR)", "Press Release", "Employee Onboarding Checklist",
+    "Performance Improvement Plan (PIP)", "Job Description", "Offer Letter", "Vendor Contract", "Non-Disclosure Agreement (NDA)",
+    "Service Level Agreement (SLA)", "Incident Report", "Change Request Form"
+]
+DEFAULT_SHEET_TYPES = [
+    "Financial Statement", "Project Timeline", "Sales Tracker", "Inventory List", "Employee Directory",
+    "Budget vs. Actuals", "Marketing Campaign Tracker", "Customer Relationship Management (CRM) Data",
+    "Lead Generation Funnel", "Social Media Content Calendar", "Gantt Chart", "Resource Allocation Plan",
+    "Risk Register", "Issue Tracker", "Payroll Register", "Accounts Receivable Aging", "Accounts Payable Aging",
+    "Cash Flow Statement", "Burn Down Chart", "Capacity Planner"
+]
+DEFAULT_PPT_TYPES = [
+    "Quarterly Review", "New Product Pitch", "Market Trend Analysis", "Team Training Guide", "Sales Kick-Off (SKO) Presentation",
+    "Investor Pitch Deck", "Company All-Hands Meeting", "Project Kick-off Presentation", "Go-to-Market Strategy",
+    "Customer Onboarding Guide", "Product Demonstration", "Competitive Landscape Review", "Post-Mortem Analysis",
+    "Annual General Meeting (AGM) Presentation", "Change Management Communication", "Technology Roadmap",
+    "Financial Results Briefing", "HR Policy Overview", "Crisis Communication Plan", "Partner Program Overview"
+]
+DEFAULT_PDF_TYPES = [
+    "Employee Manual", "Analyst Report", "User Guide", "Summary Report", "Design Guide", "Invoice",
+    "Purchase Order", "White Paper", "Case Study", "Annual Report", "Compliance Certificate", "Legal Contract",
+    "Technical Manual", "Product Brochure", "Marketing eBook", "Signed Agreement", "Official Company Statement",
+    "Terms of Service", "Privacy Policy", "Security Whitepaper"
+]
+
+ROLE_FILE_TYPES = {
+    "CEO": ["document", "presentation", "pdf"],
+    "CFO": ["spreadsheet", "document", "pdf"],
+    "CTO": ["document", "presentation", "spreadsheet"],
+    "HR_Manager": ["document", "pdf", "spreadsheet"],
+    "Sales_Manager": ["presentation", "spreadsheet", "document"],
+    "Marketing_Manager": ["presentation", "document", "image"],
+    "Project_Manager": ["spreadsheet", "document", "presentation"],
+    "Accountant": ["spreadsheet", "pdf"],
+    "Software_Engineer": ["document", "spreadsheet"],
+    "Customer_Support_Specialist": ["document", "pdf"],
+}
+
+FILE_EXTENSIONS = {
+    "document": ".docx", "spreadsheet": ".xlsx",
+    "presentation": ".pptx", "image": ".png", "pdf": ".pdf",
+}
+
+_STRING = {"type": "STRING"}
+_STRING_LIST = {"type": "ARRAY", "items": _STRING}
+# Spreadsheet rows may have blank cells.
+_CELL = {"type": "STRING", "nullable": True}
+
+# Per-file-type field schemas sent to Gemini as structured-output config.
+RESPONSE_SCHEMAS = {
+    "document": {"doc_title": _STRING, "doc_body": _STRING_LIST},
+    "spreadsheet": {
+        "sheet_title": _STRING,
+        "sheet_headers": _STRING_LIST,
+        "sheet_data": {"type": "ARRAY", "items": {"type": "ARRAY", "items": _CELL}},
+    },
+    "presentation": {
+        "ppt_title": _STRING,
+        "ppt_slide_details": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"slide_title": _STRING, "bullet_points": _STRING_LIST},
+                "required": ["slide_title", "bullet_points"],
+            },
+        },
+    },
+    "image": {"image_prompt": _STRING},
+    "pdf": {"pdf_title": _STRING, "pdf_body": _STRING_LIST},
+}
+
+# Creates Gemini clients. Benchmarks and tests can swap in a local stand-in here.
+client_factory = genai.Client
+_clients = {}
+
+def get_client(api_key):
+    """Returns a Gemini client for the API key, reusing one already created in this process."""
+    client = _clients.get(api_key)
+    if client is None:
+        client = _clients[api_key] = client_factory(api_key=api_key)
+    return client
+
 def sanitize_filename(title):
     """Converts a title into a safe filename."""
     sanitized = re.sub(r'[\\/*?:"<>|]', "", title)
     sanitized = sanitized.replace(" ", "_")
     return sanitized[:100]
 
-def generate_unique_gemini_content(theme, role, file_type, doc_types, sheet_types, ppt_types, pdf_types, api_key=None):
-    """Generates unique, themed content for a specific file type by calling the Gemini API."""
-    if not api_key:
-        api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY not found in config or environment variables.")
-
-    client = genai.Client(api_key=api_key)
+def build_response_schema(file_type, fields):
+    """Builds a Gemini response schema covering only the given fields of a file type."""
+    properties = {field: RESPONSE_SCHEMAS[file_type][field] for field in fields}
+    return {"type": "OBJECT", "properties": properties, "required": list(fields)}
 
+def build_field_prompts(theme, role, file_type, doc_types, sheet_types, ppt_types, pdf_types, rng=random):
+    """Returns a mapping of response field name to the instruction for that field."""
     if file_type == "document":
-        doc_type = random.choice(doc_types)
-        content_prompt = f'- "doc_title": "A title for a {doc_type} created by a {role}".\n- "doc_body": "A 6-paragraph body for the document, relevant to the theme, the document type of {doc_type}, and the role of {role}".'
+        doc_type = rng.choice(doc_types)
+        return {
+            "doc_title": f"A title for a {doc_type} created by a {role}",
+            "doc_body": f"A list of 6 paragraphs for the body of the document, relevant to the theme, the document type of {doc_type}, and the role of {role}",
+        }
     elif file_type == "spreadsheet":
-        sheet_type = random.choice(sheet_types)
-        content_prompt = f'- "sheet_title": "A title for a {sheet_type} created by a {role}".\n- "sheet_headers": "A list of 4-6 relevant column headers for the {sheet_type} created by a {role}".\n- "sheet_data": "A list of 15 lists, where each inner list is a row of realistic data for the {sheet_type} created by a {role}".'
+        sheet_type = rng.choice(sheet_types)
+        return {
+            "sheet_title": f"A title for a {sheet_type} created by a {role}",
+            "sheet_headers": f"A list of 4-6 relevant column headers for the {sheet_type} created by a {role}",
+            "sheet_data": f"A list of 15 lists, where each inner list is a row of realistic data for the {sheet_type} created by a {role}",
+        }
     elif file_type == "presentation":
-        ppt_type = random.choice(ppt_types)
-        content_prompt = f'- "ppt_title": "A title for a {ppt_type} created by a {role}".\n- "ppt_slide_details": "A JSON object with 4 slide titles as keys and a JSON list of 3-5 short, concise bullet points for each slide\u0027s body, relevant to a {ppt_type} created by a {role}".'
+        ppt_type = rng.choice(ppt_types)
+        return {
+            "ppt_title": f"A title for a {ppt_type} created by a {role}",
+            "ppt_slide_details": f"A list of 4 slides, each with a slide_title and a list of 3-5 short, concise bullet_points, relevant to a {ppt_type} created by a {role}",
+        }
     elif file_type == "image":
         art_styles = ["photorealistic", "oil painting", "watercolor", "art deco", "cyberpunk", "fantasy art", "impressionistic", "surreal", "minimalist", "art nouveau"]
         settings = ["a grand hall", "a sun-dappled forest", "a modern office", "a futuristic cityscape", "a subterranean cavern", "a mountaintop observatory", "a bustling marketplace"]
         moods = ["serious", "whimsical", "optimistic", "mysterious", "serene", "dramatic", "inspirational"]
         compositions = ["wide shot", "close-up", "dynamic angle", "symmetrical", "asymmetrical", "leading lines", "rule of thirds"]
 
-        style = random.choice(art_styles)
-        setting = random.choice(settings)
-        mood = random.choice(moods)
-        composition = random.choice(compositions)
+        style = rng.choice(art_styles)
+        setting = rng.choice(settings)
+        mood = rng.choice(moods)
+        composition = rng.choice(compositions)
 
-        content_prompt = f'- "image_prompt": "A concise, highly creative, and descriptive prompt for an AI image model. The prompt must be unique and not a repeat of previous requests. Incorporate the following elements: theme: \'{theme}\', creator\u0027s role: \'{role}\', artistic style: \'{style}\', setting: \'{setting}\', mood: \'{mood}\', composition: \'{composition}\'. Be imaginative and avoid clichés.".'
+        return {
+            "image_prompt": f"A concise, highly creative, and descriptive prompt for an AI image model. The prompt must be unique and not a repeat of previous requests. Incorporate the following elements: theme: '{theme}', creator's role: '{role}', artistic style: '{style}', setting: '{setting}', mood: '{mood}', composition: '{composition}'. Be imaginative and avoid clichés.",
+        }
     elif file_type == "pdf":
-        pdf_type = random.choice(pdf_types)
-        content_prompt = f'- "pdf_title": "A title for a {pdf_type} created by a {role}".\n- "pdf_body": "A 6-paragraph body for the document, relevant to the theme, the document type of {pdf_type}, and the role of {role}".'
-    else:
-        return None
+        pdf_type = rng.choice(pdf_types)
+        return {
+            "pdf_title": f"A title for a {pdf_type} created by a {role}",
+            "pdf_body": f"A list of 6 paragraphs for the body of the document, relevant to the theme, the document type of {pdf_type}, and the role of {role}",
+        }
+    return None
 
-    prompt = f"""
+def build_content_prompt(theme, role, file_type, field_prompts, fields):
+    """Returns the prompt that asks Gemini for the given fields of a file."""
+    content_prompt = "\n".join(f'- "{field}": "{field_prompts[field]}".' for field in fields)
+    return f"""
     You are a creative assistant that generates realistic, unique business documents for a fictional company.
     The business theme is: "{theme}"
     The requested file type is: "{file_type}"
@@ -77,17 +194,195 @@ def generate_unique_gemini_content(theme, role, file_type, doc_types, sheet_type
     Generate content for the following items in valid JSON format:
     {content_prompt}
     """
+
+def choose_file_type(rng, file_types, role):
+    """Picks the type of a user's next file: from file_types if set, else from the role's usual types."""
+    if file_types:
+        return rng.choice(file_types)
+    return rng.choice(ROLE_FILE_TYPES.get(role, ["document"]))
+
+def _close_truncated_json(text):
+    """Closes any string, array or object left open by a truncated JSON response."""
+    stack = []
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    text = text.rstrip()
+    if stack and stack[-1] == "}":
+        # A key cut off before its value is dropped, so the complete fields before it survive.
+        text = re.sub(r'(?<=[{,])\s*"(?:[^"\\]|\\.)*"\s*:?\s*$', "", text)
+    text = re.sub(r'[,:]\s*$', "", text.rstrip())
+    return text + "".join(reversed(stack))
+
+def repair_json(text):
+    """Parses a JSON object from a model response, repairing common defects. Returns None if hopeless."""
+    if not text:
+        return None
+    text = text.strip().replace("```json", "").replace("```", "").strip()
+    start = text.find("{")
+    if start == -1:
+        return None
+    end = text.rfind("}")
+    candidates = [text]
+    if end > start:
+        candidates.append(text[start:end + 1])
+    candidates.append(_close_truncated_json(text[start:]))
+
+    for candidate in candidates:
+        for attempt in (candidate, re.sub(r',\s*([}\]])', r'\1', candidate)):
+            try:
+                parsed = json.loads(attempt)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(parsed, dict):
+                return parsed
+    return None
+
+def _is_empty(value):
+    return value is None or (isinstance(value, str) and not value.strip()) or (isinstance(value, (list, dict)) and not value)
+
+def _matches_schema(value, schema):
+    """Checks the shape of a value against a (small) Gemini schema. Empty strings and lists inside it are allowed."""
+    if value is None:
+        return schema.get("nullable", False)
+    if schema["type"] == "STRING":
+        return isinstance(value, (str, int, float))
+    if schema["type"] == "ARRAY":
+        return isinstance(value, list) and all(_matches_schema(item, schema["items"]) for item in value)
+    if schema["type"] == "OBJECT":
+        return isinstance(value, dict) and all(_matches_schema(value.get(key), schema["properties"][key]) for key in schema.get("required", []))
+    return False
+
+def validate_content(file_type, content):
+    """Returns the fields of a file type's schema that are missing, empty or invalid in the content."""
+    missing = []
+    for field, schema in RESPONSE_SCHEMAS[file_type].items():
+        value = content.get(field)
+        # Older free-form responses describe slides as {"title": [bullets]}; accept that shape too.
+        if field == "ppt_slide_details" and isinstance(value, dict) and value:
+            continue
+        if _is_empty(value) or not _matches_schema(value, schema):
+            missing.append(field)
+    return missing
+
+def normalize_content(file_type, content):
+    """Converts schema-shaped content into the shape the file renderers expect."""
+    if file_type == "presentation" and isinstance(content.get("ppt_slide_details"), list):
+        content["ppt_slide_details"] = {
+            slide["slide_title"]: slide["bullet_points"] for slide in content["ppt_slide_details"]
+        }
+    return content
+
+def _response_to_dict(response):
+    """Extracts a JSON object from a Gemini response, falling back to local repair."""
+    parsed = getattr(response, "parsed", None)
+    if isinstance(parsed, dict):
+        return parsed
+    text = getattr(response, "text", None)
     try:
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
-        )
-        clean_response = response.text.strip().replace("```json", "").replace("```", "")
-        return json.loads(clean_response)
-    except (json.JSONDecodeError, Exception) as e:
-        print(f"Error parsing Gemini text response: {e}")
+        parsed = json.loads(text)
+    except (TypeError, json.JSONDecodeError):
+        parsed = None
+    if isinstance(parsed, dict):
+        return parsed
+    repaired = repair_json(text)
+    if repaired is not None:
+        metrics.incr("docs_content_repaired")
+    return repaired
+
+def generate_unique_gemini_content(theme, role, file_type, doc_types, sheet_types, ppt_types, pdf_types, api_key=None, max_retries=2, rng=random):
+    """Generates unique, themed content for a specific file type by calling the Gemini API.
+
+    Responses are constrained by the file type's schema. Fields that are still missing
+    or invalid after local repair are re-requested on their own, up to max_retries times.
+    """
+    if not api_key:
+        api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not found in config or environment variables.")
+
+    field_prompts = build_field_prompts(theme, role, file_type, doc_types, sheet_types, ppt_types, pdf_types, rng)
+    if field_prompts is None:
         return None
 
+    client = get_client(api_key)
+    content = {}
+    missing = list(field_prompts)
+
+    for attempt in range(max_retries + 1):
+        if attempt:
+            metrics.incr("docs_content_retries")
+            print(f"Re-requesting missing fields: {', '.join(missing)}")
+        prompt = build_content_prompt(theme, role, file_type, field_prompts, missing)
+        metrics.incr("docs_content_calls")
+        try:
+            with metrics.timer("docs_llm_latency_seconds", model=TEXT_MODEL):
+                response = client.models.generate_content(
+                    model=TEXT_MODEL,
+                    contents=prompt,
+                    config=types.GenerateContentConfig(
+                        response_mime_type="application/json",
+                        response_schema=build_response_schema(file_type, missing),
+                    ),
+                )
+        except Exception as e:
+            metrics.incr("docs_content_api_errors")
+            print(f"Error calling Gemini API: {e}")
+            continue
+        record_token_usage(response, TEXT_MODEL)
+
+        parsed = _response_to_dict(response)
+        if parsed is None:
+            metrics.incr("docs_content_parse_failures")
+            print("Error parsing Gemini text response: no JSON object could be recovered.")
+            continue
+
+        for field in missing:
+            if field in parsed:
+                content[field] = parsed[field]
+        missing = validate_content(file_type, content)
+        for field in missing:
+            content.pop(field, None)
+        if not missing:
+            metrics.incr("docs_content_usable")
+            return normalize_content(file_type, content)
+
+    metrics.incr("docs_content_failed")
+    return None
+
+def record_token_usage(response, model):
+    """Counts the input and output tokens Gemini reports for a response, if it reports them."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    metrics.incr("docs_llm_input_tokens", getattr(usage, "prompt_token_count", None) or 0, model=model)
+    metrics.incr("docs_llm_output_tokens", getattr(usage, "candidates_token_count", None) or 0, model=model)
+
+def format_generation_stats():
+    """Summarizes content generation outcomes for the end-of-run report."""
+    count = {name: metrics.get_counter(f"docs_content_{name}") for name in ("usable", "failed", "calls", "retries", "repaired")}
+    attempted = count["usable"] + count["failed"]
+    return (
+        f"{count['usable']}/{attempted} files had usable content "
+        f"({count['calls']} API calls, {count['retries']} retries, "
+        f"{count['repaired']} repaired responses, {count['failed']} failures)"
+    )
+
 
 
 def generate_image_from_api(prompt, file_path, api_key=None):
@@ -95,13 +390,16 @@ def generate_image_from_api(prompt, file_path, api_key=None):
     try:
         if not api_key:
             api_key = os.getenv("GEMINI_API_KEY")
-        client = genai.Client(api_key=api_key)
+        client = get_client(api_key)
         print(f"Submitting unique image prompt to Gemini: '{prompt}'")
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-preview-image-generation",
-            contents=prompt,
-            config=types.GenerateContentConfig(response_modalities=['TEXT', 'IMAGE'])
-        )
+        metrics.incr("docs_image_calls")
+        with metrics.timer("docs_llm_latency_seconds", model=IMAGE_MODEL):
+            response = client.models.generate_content(
+                model=IMAGE_MODEL,
+                contents=prompt,
+                config=types.GenerateContentConfig(response_modalities=['TEXT', 'IMAGE'])
+            )
+        record_token_usage(response, IMAGE_MODEL)
         for part in response.candidates[0].content.parts:
             if part.inline_data:
                 image = Image.open(io.BytesIO(part.inline_data.data))
@@ -109,6 +407,7 @@ def generate_image_from_api(prompt, file_path, api_key=None):
                 print(f"Successfully generated and saved AI image: {file_path}")
                 return
     except Exception as e:
+        metrics.incr("docs_image_failures")
         print(f"Could not generate or save image due to an API error: {e}")
         img = Image.new('RGB', (800, 600), color=(50, 10, 10))
         from PIL import ImageDraw
@@ -214,73 +513,228 @@ def generate_presentation(user, org_name, file_path, fake, theme_content):
 
     prs.save(file_path)
 
-def main():
-    parser = argparse.ArgumentParser(description="Generate unique, random files for a small business using the Gemini API.")
-    parser.add_argument("--users", nargs="+", required=True, help="List of usernames.")
-    parser.add_argument("--num-files", type=int, default=5, help="Number of files per user.")
-    parser.add_argument("--org-name", required=True, help="Name of the organization.")
-    parser.add_argument("--theme", required=True, help="Business model theme.")
-    parser.add_argument("--api-key", help="Gemini API key.")
-    parser.add_argument("--roles", nargs="+", default=["CEO", "CFO", "CTO", "HR_Manager", "Sales_Manager", "Marketing_Manager", "Project_Manager", "Accountant", "Software_Engineer", "Customer_Support_Specialist"], help="List of roles to generate files for.")
-    parser.add_argument("--file-types", type=json.loads, default='["document", "spreadsheet", "presentation", "image", "pdf"]', help="JSON list of file types to generate.")
-    parser.add_argument("--doc-types", type=json.loads, default='["Internal Memo", "Project Proposal", "Competitive Analysis", "Budget Report", "Meeting Minutes", "Business Requirements Document (BRD)", "Standard Operating Procedure (SOP)", "Marketing Plan", "Sales Strategy", "Quarterly Business Review (QBR)", "Press Release", "Employee Onboarding Checklist", "Performance Improvement Plan (PIP)", "Job Description", "Offer Letter", "Vendor Contract", "Non-Disclosure Agreement (NDA)", "Service Level Agreement (SLA)", "Incident Report", "Change Request Form"]', help="JSON list of document types.")
-    parser.add_argument("--sheet-types", type=json.loads, default='["Financial Statement", "Project Timeline", "Sales Tracker", "Inventory List", "Employee Directory", "Budget vs. Actuals", "Marketing Campaign Tracker", "Customer Relationship Management (CRM) Data", "Lead Generation Funnel", "Social Media Content Calendar", "Gantt Chart", "Resource Allocation Plan", "Risk Register", "Issue Tracker", "Payroll Register", "Accounts Receivable Aging", "Accounts Payable Aging", "Cash Flow Statement", "Burn Down Chart", "Capacity Planner"]', help="JSON list of spreadsheet types.")
-    parser.add_argument("--ppt-types", type=json.loads, default='["Quarterly Review", "New Product Pitch", "Market Trend Analysis", "Team Training Guide", "Sales Kick-Off (SKO) Presentation", "Investor Pitch Deck", "Company All-Hands Meeting", "Project Kick-off Presentation", "Go-to-Market Strategy", "Customer Onboarding Guide", "Product Demonstration", "Competitive Landscape Review", "Post-Mortem Analysis", "Annual General Meeting (AGM) Presentation", "Change Management Communication", "Technology Roadmap", "Financial Results Briefing", "HR Policy Overview", "Crisis Communication Plan", "Partner Program Overview"]', help="JSON list of presentation types.")
-    parser.add_argument("--pdf-types", type=json.loads, default='["Employee Manual", "Analyst Report", "User Guide", "Summary Report", "Design Guide", "Invoice", "Purchase Order", "White Paper", "Case Study", "Annual Report", "Compliance Certificate", "Legal Contract", "Technical Manual", "Product Brochure", "Marketing eBook", "Signed Agreement", "Official Company Statement", "Terms of Service", "Privacy Policy", "Security Whitepaper"]', help="JSON list of PDF types.")
-    args = parser.parse_args()
+def generate_docs(config, api_key=None, manifest=None):
+    """Generates num_files themed files per user from a parsed config and returns the paths written."""
+    users = get_users(config)
+    docs_config = config.get("docs", {})
+    theme = get_config_value(docs_config, "theme")
+    if not users or not theme:
+        raise ValueError("'users' (or a users file) and 'docs.theme' must be defined in the config.")
+
+    api_key = api_key or get_config_value(config, "gemini_api_key")
+    num_files = get_config_value(docs_config, "num_files", 10)
+    org_name = get_config_value(docs_config, "org_name", "Shire Holdings")
+    max_retries = get_config_value(docs_config, "max_content_retries", 2)
+    output_root = get_config_value(docs_config, "output_dir", "output")
+    roles = get_config_value(docs_config, "roles", DEFAULT_ROLES)
+    file_types = get_config_value(docs_config, "file_types", DEFAULT_FILE_TYPES)
+    doc_types = get_config_value(docs_config, "doc_types", DEFAULT_DOC_TYPES)
+    sheet_types = get_config_value(docs_config, "sheet_types", DEFAULT_SHEET_TYPES)
+    ppt_types = get_config_value(docs_config, "ppt_types", DEFAULT_PPT_TYPES)
+    pdf_types = get_config_value(docs_config, "pdf_types", DEFAULT_PDF_TYPES)
+
+    configured_seed = get_config_value(config, "seed")
+    base_seed = manifest.base_seed(configured_seed) if manifest else configured_seed
+    config_hash = section_hash(docs_config, TEXT_MODEL, IMAGE_MODEL, base_seed)
+
+    def rng_for(*parts):
+        return random.Random(derive_seed(base_seed, "docs", *parts)) if base_seed is not None else random
 
     fake = Faker()
 
-    role_file_types = {
-        "CEO": ["document", "presentation", "pdf"],
-        "CFO": ["spreadsheet", "document", "pdf"],
-        "CTO": ["document", "presentation", "spreadsheet"],
-        "HR_Manager": ["document", "pdf", "spreadsheet"],
-        "Sales_Manager": ["presentation", "spreadsheet", "document"],
-        "Marketing_Manager": ["presentation", "document", "image"],
-        "Project_Manager": ["spreadsheet", "document", "presentation"],
-        "Accountant": ["spreadsheet", "pdf"],
-        "Software_Engineer": ["document", "spreadsheet"],
-        "Customer_Support_Specialist": ["document", "pdf"],
-    }
-
     file_generators = {
         "document": generate_document,
         "spreadsheet": generate_spreadsheet,
         "presentation": generate_presentation,
-        "image": lambda user, org, path, f, content: generate_image_from_api(content.get('image_prompt'), path, api_key=args.api_key),
+        "image": lambda user, org, path, f, content: generate_image_from_api(content.get('image_prompt'), path, api_key=api_key),
         "pdf": generate_pdf,
     }
-    file_extensions = {
-        "document": ".docx", "spreadsheet": ".xlsx",
-        "presentation": ".pptx", "image": ".png", "pdf": ".pdf",
+
+    shard = get_shard(config)
+    written = []
+    outputs = []
+    up_to_date = 0
+    sink = open_sink(docs_config, "docs", output_root, shard)
+    try:
+        for user in users:
+            if shard and not shard.owns(user):
+                continue
+            outputs.extend(f"{user}/{i + 1}" for i in range(num_files))
+            # Users from an org file keep their role; others are given a random one.
+            role = get_role(users, user) or rng_for(user, "role").choice(roles)
+            for i in range(num_files):
+                artifact_id = f"{user}/{i + 1}"
+                if manifest and manifest.is_fresh(artifact_id, config_hash):
+                    name = f"{user}/{os.path.basename(manifest.get(artifact_id)['path'])}"
+                    keep_stored(sink, manifest, artifact_id, name)
+                    written.append(sink.describe(name))
+                    up_to_date += 1
+                    metrics.incr("docs_files_skipped")
+                    continue
+
+                rng = rng_for(user, i + 1)
+                seed = derive_seed(base_seed, "docs", user, i + 1) if base_seed is not None else None
+                file_type = choose_file_type(rng, file_types, role)
+
+                print(f"--- Generating unique content for {user} ({role}) - {file_type} ---")
+                theme_content = generate_unique_gemini_content(theme, role, file_type, doc_types, sheet_types, ppt_types, pdf_types, api_key=api_key, max_retries=max_retries, rng=rng)
+
+                if theme_content:
+                    title = theme_content.get("doc_title") or theme_content.get("sheet_title") or theme_content.get("ppt_title") or theme_content.get("pdf_title") or f"image_{i+1}"
+                    name = f"{user}/{sanitize_filename(title)}{FILE_EXTENSIONS[file_type]}"
+
+                    # A stale file from an earlier run may have had a different title.
+                    previous = manifest.get(artifact_id) if manifest else None
+                    if sink.exists(name) and not (previous and previous.get("path") == sink.path_of(name)):
+                        name = f"{user}/{sanitize_filename(title)}_{i + 1}{FILE_EXTENSIONS[file_type]}"
+                    if (previous and not previous.get("archive") and previous.get("path") not in (None, sink.path_of(name))
+                            and os.path.exists(previous["path"])):
+                        os.remove(previous["path"])
+
+                    print(f"--- Saving file: {sink.path_of(name)} ---")
+                    try:
+                        with metrics.timer("docs_render_seconds", file_type=file_type), sink.writer(name) as file_path:
+                            file_generators[file_type](user, org_name, file_path, fake, theme_content)
+                            size = os.path.getsize(file_path)
+                        written.append(sink.describe(name))
+                        metrics.incr("docs_files_written", file_type=file_type)
+                        metrics.incr("docs_bytes_written", size, file_type=file_type)
+                        sink.record(manifest, artifact_id, name, config_hash=config_hash, seed=seed,
+                                    inputs={"role": role, "file_type": file_type})
+                    except Exception as e:
+                        print(f"Error generating file {sink.path_of(name)}: {e}")
+                        if manifest:
+                            manifest.record_failure(artifact_id, config_hash, seed=seed, error=str(e))
+                else:
+                    print(f"Skipping file due to content generation failure.")
+                    if manifest:
+                        manifest.record_failure(artifact_id, config_hash, seed=seed, error="content generation failed")
+    finally:
+        sink.close()
+
+    if manifest:
+        manifest.record("docs", None, config_hash, seed=base_seed,
+                        inputs=shard_summary(shard, outputs, len(users) * num_files))
+    if up_to_date:
+        print(f"\nSkipped {up_to_date} files that were already up to date.")
+    print(f"\nContent generation: {format_generation_stats()}")
+    return written
+
+def plan_docs(config):
+    """Replays generate_docs' seeded draws to count its files by type and its Gemini calls and tokens by model."""
+    users = get_planned_users(config)
+    docs_config = config.get("docs", {})
+    theme = get_config_value(docs_config, "theme") or ""
+    num_files = get_config_value(docs_config, "num_files", 10)
+    max_retries = get_config_value(docs_config, "max_content_retries", 2)
+    roles = get_config_value(docs_config, "roles", DEFAULT_ROLES)
+    file_types = get_config_value(docs_config, "file_types", DEFAULT_FILE_TYPES)
+    doc_types = get_config_value(docs_config, "doc_types", DEFAULT_DOC_TYPES)
+    sheet_types = get_config_value(docs_config, "sheet_types", DEFAULT_SHEET_TYPES)
+    ppt_types = get_config_value(docs_config, "ppt_types", DEFAULT_PPT_TYPES)
+    pdf_types = get_config_value(docs_config, "pdf_types", DEFAULT_PDF_TYPES)
+    shard = get_shard(config)
+
+    notes = []
+    base_seed = get_config_value(config, "seed")
+    if base_seed is None:
+        notes.append("No seed is set, so the file types are one representative draw.")
+        base_seed = 0
+    elif org_generates_users(config):
+        notes.append("The org stage has not named the users yet, so the file types are one representative draw.")
+    if not (get_config_value(config, "gemini_api_key") or os.getenv("GEMINI_API_KEY")):
+        notes.append("No Gemini API key is configured, so every file will fail.")
+
+    files = {}
+    input_chars = 0
+    schema_chars = {}
+    for user in users:
+        if shard and not shard.owns(user):
+            continue
+        role = get_role(users, user) or random.Random(derive_seed(base_seed, "docs", user, "role")).choice(roles)
+        for i in range(num_files):
+            rng = random.Random(derive_seed(base_seed, "docs", user, i + 1))
+            file_type = choose_file_type(rng, file_types, role)
+            field_prompts = build_field_prompts(theme, role, file_type, doc_types, sheet_types, ppt_types, pdf_types, rng)
+            if field_prompts is None:
+                continue
+            files[file_type] = files.get(file_type, 0) + 1
+            fields = list(field_prompts)
+            input_chars += len(build_content_prompt(theme, role, file_type, field_prompts, fields))
+            if file_type not in schema_chars:
+                schema_chars[file_type] = len(json.dumps(build_response_schema(file_type, fields)))
+            input_chars += schema_chars[file_type]
+
+    text_calls = sum(files.values())
+    images = files.get("image", 0)
+    api_calls = {TEXT_MODEL: text_calls}
+    tokens = {TEXT_MODEL: {
+        "input": input_chars // CHARS_PER_TOKEN,
+        "output": sum(count * DOCS_OUTPUT_TOKENS[file_type] for file_type, count in files.items()),
+    }}
+    if images:
+        api_calls[IMAGE_MODEL] = images
+        tokens[IMAGE_MODEL] = {"input": images * DOCS_OUTPUT_TOKENS["image"], "output": images * IMAGE_OUTPUT_TOKENS}
+    if max_retries and text_calls:
+        notes.append(f"Retries can take up to {text_calls * (max_retries + 1)} calls to {TEXT_MODEL}.")
+    return {
+        "jobs": {"files": text_calls, **files},
+        # An image's call to the image model is timed as part of rendering it.
+        "work": {"api_calls": {TEXT_MODEL: text_calls}, "files": files},
+        "api_calls": api_calls,
+        "tokens": tokens,
+        "outputs": {file_type: {"files": count, "bytes": count * DOCS_FILE_BYTES[file_type]}
+                    for file_type, count in files.items()},
+        "memory_bytes": len(users) * USER_MEMORY_BYTES + DOCS_RENDER_MEMORY_BYTES,
+        "notes": notes,
     }
 
-    for user in args.users:
-        role = random.choice(args.roles)
-        output_dir = os.path.join("output", user)
-        os.makedirs(output_dir, exist_ok=True)
-        for i in range(args.num_files):
-            if args.file_types:
-                file_type = random.choice(args.file_types)
-            else:
-                file_type = random.choice(role_file_types.get(role, ["document"]))
-
-            print(f"--- Generating unique content for {user} ({role}) - {file_type} ---")
-            theme_content = generate_unique_gemini_content(args.theme, role, file_type, args.doc_types, args.sheet_types, args.ppt_types, args.pdf_types, api_key=args.api_key)
-
-            if theme_content:
-                title = theme_content.get("doc_title") or theme_content.get("sheet_title") or theme_content.get("ppt_title") or theme_content.get("pdf_title") or f"image_{i+1}"
-                file_name = f"{sanitize_filename(title)}{file_extensions[file_type]}"
-                file_path = os.path.join(output_dir, file_name)
-
-                print(f"--- Saving file: {file_path} ---")
-                try:
-                    file_generators[file_type](user, args.org_name, file_path, fake, theme_content)
-                except Exception as e:
-                    print(f"Error generating file {file_path}: {e}")
-            else:
-                print(f"Skipping file due to content generation failure.")
+def main():
+    parser = argparse.ArgumentParser(description="Generate unique, random files for a small business using the Gemini API.")
+    parser.add_argument("--config", help="Path to a config file. Other arguments override its values.")
+    parser.add_argument("--users", nargs="+", help="List of usernames.")
+    parser.add_argument("--num-files", type=int, help="Number of files per user (default 5).")
+    parser.add_argument("--org-name", help="Name of the organization. Required unless the config sets it.")
+    parser.add_argument("--theme", help="Business model theme. Required unless the config sets it.")
+    parser.add_argument("--api-key", help="Gemini API key.")
+    parser.add_argument("--max-retries", type=int, help="Number of targeted re-requests for fields missing from a Gemini response.")
+    parser.add_argument("--output-dir", help="Directory under which a folder of files is created per user.")
+    parser.add_argument("--roles", nargs="+", help="List of roles to generate files for.")
+    parser.add_argument("--file-types", type=json.loads, help="JSON list of file types to generate.")
+    parser.add_argument("--doc-types", type=json.loads, help="JSON list of document types.")
+    parser.add_argument("--sheet-types", type=json.loads, help="JSON list of spreadsheet types.")
+    parser.add_argument("--ppt-types", type=json.loads, help="JSON list of presentation types.")
+    parser.add_argument("--pdf-types", type=json.loads, help="JSON list of PDF types.")
+    args = parser.parse_args()
+
+    config = load_config(args.config) if args.config else {}
+    if args.users:
+        config["users"] = {"value": {user: [user, user] for user in args.users}}
+    docs_config = config.setdefault("docs", {})
+    docs_config.update(make_config(
+        num_files=args.num_files,
+        org_name=args.org_name,
+        theme=args.theme,
+        max_content_retries=args.max_retries,
+        output_dir=args.output_dir,
+        roles=args.roles,
+        file_types=args.file_types,
+        doc_types=args.doc_types,
+        sheet_types=args.sheet_types,
+        ppt_types=args.ppt_types,
+        pdf_types=args.pdf_types,
+    ))
+    # Unless the config sets it, the script keeps its own default rather than generate_all.py's.
+    docs_config.setdefault("num_files", {"value": 5})
+    missing = [flag for flag, key in (("--org-name", "org_name"), ("--theme", "theme")) if key not in docs_config]
+    if missing:
+        parser.error(f"the following arguments are required: {', '.join(missing)}")
+
+    try:
+        generate_docs(config, api_key=args.api_key)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
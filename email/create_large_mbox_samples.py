@@ -13,14 +13,28 @@
 
 
 import csv
+import io
 import random
 import os
 import sys
 import mailbox
 import argparse
 import numpy as np
-import json
 import re
+import time
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from orgconfig import ROOT_DIR, get_config_value, load_config, make_config
+from orgdata import get_contacts, get_planned_users, get_users, people_fingerprint
+from sharding import get_shard, shard_summary
+from output_sink import keep_stored, open_sink
+from manifest import derive_seed, input_fingerprint, section_hash
+from planner import ADDRESS_MEMORY_BYTES, MESSAGE_BYTES
+import metrics
+
+# Where the Enron emails.csv is expected unless the config says otherwise.
+DEFAULT_SOURCE_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'enron', 'emails.csv')
 
 def set_csv_field_size_limit():
     """Sets the CSV field size limit to the maximum possible value."""
@@ -32,13 +46,110 @@ def set_csv_field_size_limit():
         except OverflowError:
             max_int = int(max_int / 2)
 
-def get_email_samples(csv_path, num_samples):
+class _OffsetLines:
+    """Iterates over the lines of a binary file as text, keeping track of the byte offset."""
+
+    def __init__(self, f):
+        self.f = f
+        self.offset = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        raw = self.f.readline()
+        if not raw:
+            raise StopIteration
+        self.offset += len(raw)
+        return _decode(raw)
+
+def _decode(raw):
+    # Matches reading the file in text mode, as the full scan does.
+    return raw.decode('utf-8', 'ignore').replace('\r\n', '\n').replace('\r', '\n')
+
+class CorpusIndex:
+    """The byte offsets of every usable row of a source CSV, for sampling without a full scan."""
+
+    def __init__(self, csv_path):
+        set_csv_field_size_limit()
+        self.csv_path = csv_path
+        self.fingerprint = input_fingerprint(csv_path)
+        self.rows = array('q')
+        self.starts = array('q')
+        self.ends = array('q')
+
+        with open(csv_path, 'rb') as f:
+            lines = _OffsetLines(f)
+            reader = csv.reader(lines)
+            header = next(reader, None)
+            if not header or 'message' not in header:
+                raise ValueError(f"{csv_path} has no 'message' column.")
+            self.message_col_index = header.index('message')
+            i = 0
+            while True:
+                start = lines.offset
+                row = next(reader, None)
+                if row is None:
+                    break
+                if len(row) > self.message_col_index:
+                    self.rows.append(i)
+                    self.starts.append(start)
+                    self.ends.append(lines.offset)
+                i += 1
+        self.num_rows = i
+
+    def is_current(self):
+        return input_fingerprint(self.csv_path) == self.fingerprint
+
+    def sample(self, num_samples, rng=random):
+        """Samples exactly the messages get_email_samples would with the same rng state."""
+        # Replay the reservoir's random draws over the row numbers, then read only the winners.
+        reservoir = []
+        for k, i in enumerate(self.rows):
+            if i < num_samples:
+                reservoir.append(k)
+            else:
+                j = rng.randint(0, i)
+                if j < num_samples:
+                    reservoir[j] = k
+
+        messages = [None] * len(reservoir)
+        with open(self.csv_path, 'rb') as f:
+            for slot, k in sorted(enumerate(reservoir), key=lambda item: self.starts[item[1]]):
+                f.seek(self.starts[k])
+                text = _decode(f.read(self.ends[k] - self.starts[k]))
+                messages[slot] = next(csv.reader(io.StringIO(text)))[self.message_col_index]
+        return messages
+
+# Corpus indexes kept in memory by long-running processes (see worker_daemon.py), so
+# repeated jobs sample the same CSV without scanning it again.
+_corpus_indexes = {}
+
+def cache_corpus_index(csv_path):
+    """Builds (or reuses) the in-memory index of a source CSV and returns it."""
+    key = os.path.abspath(csv_path)
+    index = _corpus_indexes.get(key)
+    if index is None or not index.is_current():
+        with metrics.timer("email_corpus_index_seconds"):
+            index = CorpusIndex(key)
+        _corpus_indexes[key] = index
+    return index
+
+def get_email_samples(csv_path, num_samples, rng=random):
     """
     Uses reservoir sampling to select a random sample of email messages
     from a large CSV file.
     """
     set_csv_field_size_limit()
 
+    index = _corpus_indexes.get(os.path.abspath(csv_path))
+    if index is not None and index.is_current():
+        print(f"Sampling {num_samples} emails using the cached index of {csv_path}...")
+        reservoir = index.sample(num_samples, rng)
+        metrics.incr("email_corpus_index_hits")
+        print(f"Sampling complete. Acquired {len(reservoir)} samples.")
+        return reservoir
+
     reservoir = []
     message_col_index = -1
 
@@ -57,13 +168,17 @@ def get_email_samples(csv_path, num_samples):
             return []
 
     print(f"Step 2: Performing reservoir sampling for {num_samples} emails. This will take a while...")
+    start = time.perf_counter()
+    rows_scanned = 0
     with open(csv_path, 'r', encoding='utf-8', errors='ignore') as f:
         reader = csv.reader(f)
         next(reader)  # Skip header
 
         for i, row in enumerate(reader):
+            rows_scanned = i + 1
             if (i + 1) % 50000 == 0:
-                print(f"  ...processed {i + 1} rows...")
+                rate = rows_scanned / (time.perf_counter() - start)
+                print(f"  ...processed {i + 1} rows ({rate:,.0f} rows/s)...")
 
             if len(row) <= message_col_index:
                 continue # Skip malformed rows
@@ -71,89 +186,188 @@ def get_email_samples(csv_path, num_samples):
             if i < num_samples:
                 reservoir.append(row[message_col_index])
             else:
-                j = random.randint(0, i)
+                j = rng.randint(0, i)
                 if j < num_samples:
                     reservoir[j] = row[message_col_index]
 
+    elapsed = time.perf_counter() - start
+    metrics.incr("email_rows_scanned", rows_scanned)
+    metrics.incr("email_csv_bytes_scanned", os.path.getsize(csv_path))
+    metrics.observe("email_csv_scan_seconds", elapsed)
+    if elapsed > 0:
+        metrics.set_gauge("email_rows_scanned_per_second", rows_scanned / elapsed)
     print(f"Sampling complete. Acquired {len(reservoir)} samples.")
     return reservoir
 
-def replace_email_addresses(text, replacement_emails, contacts):
+def replace_email_addresses(text, replacement_emails, contacts, rng=random):
     if not replacement_emails and not contacts:
         return text
 
-    choices = replacement_emails * 10 + contacts
-    if not choices:
-        return text
+    # Each user is ten times as likely to be picked as each contact. Picking the group
+    # first avoids building a weighted list, which is large for big organizations.
+    user_weight = 10 * len(replacement_emails)
+    total_weight = user_weight + len(contacts)
 
     def repl(match):
-        return random.choice(choices)
+        if rng.random() * total_weight < user_weight:
+            return rng.choice(replacement_emails)
+        return rng.choice(contacts)
 
     email_regex = r'[\w\.-]+@[\w\.-]+'
     return re.sub(email_regex, repl, text)
 
-def create_mbox_from_messages(messages, mbox_path, replacement_emails, contacts):
+def create_mbox_from_messages(messages, mbox_path, replacement_emails, contacts, rng=random):
     """
-    Creates a single .mbox file from a list of email message strings.
+    Creates a single .mbox file from a list of email message strings,
+    replacing any existing file at that path.
     """
     print(f"Creating mbox file at {mbox_path}...")
+    if os.path.exists(mbox_path):
+        os.remove(mbox_path)
     mb = mailbox.mbox(mbox_path)
     mb.lock()
 
     try:
-        for msg_content in messages:
-            msg_content = replace_email_addresses(msg_content, replacement_emails, contacts)
-            # The content from the CSV is a full email, so we can add it directly
-            msg = mailbox.mboxMessage(msg_content.encode('utf-8', 'ignore'))
-            mb.add(msg)
+        with metrics.timer("email_mbox_write_seconds"):
+            for msg_content in messages:
+                msg_content = replace_email_addresses(msg_content, replacement_emails, contacts, rng)
+                # The content from the CSV is a full email, so we can add it directly
+                msg = mailbox.mboxMessage(msg_content.encode('utf-8', 'ignore'))
+                mb.add(msg)
+            mb.flush()
         print(f"Successfully added {len(messages)} emails to {mbox_path}")
     finally:
         mb.flush()
         mb.close()
+    metrics.incr("email_messages_written", len(messages))
+    metrics.incr("email_files_written")
+    metrics.incr("email_bytes_written", os.path.getsize(mbox_path))
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Create large mbox samples from a CSV file.")
-    parser.add_argument("--num-samples", type=int, default=10000, help="Total number of email samples to extract.")
-    parser.add_argument("--output-dir", default="email/email_samples", help="Directory to save the mbox files.")
-    parser.add_argument("--num-mbox-files", type=int, default=2, help="Number of mbox files to create.")
-    args = parser.parse_args()
+def mbox_artifact_ids(num_mbox_files):
+    return [f'samples_{i+1}.mbox' for i in range(num_mbox_files)]
 
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    config_path = os.path.join(script_dir, '..', 'config.json')
+def generate_mailboxes(config, manifest=None):
+    """Samples emails into .mbox files from a parsed config and returns the paths written."""
+    domain = get_config_value(config, 'domain')
+    if not domain:
+        raise ValueError("'domain' not found in config")
 
-    if not os.path.exists(config_path):
-        print(f"Error: config.json not found at {config_path}")
-        sys.exit(1)
+    email_config = config.get('email', {})
+    num_samples = get_config_value(email_config, 'num_samples', 1000)
+    output_dir = get_config_value(email_config, 'output_dir', 'output/email')
+    num_mbox_files = get_config_value(email_config, 'num_mbox_files', 2)
+    csv_file = get_config_value(email_config, 'source_csv', DEFAULT_SOURCE_CSV)
 
-    with open(config_path, 'r') as f:
-        config = json.load(f)
+    users = get_users(config)
+    replacement_emails = [f"{v[1]}@{domain}" for v in users.values()]
 
-    domain = config.get('domain', {}).get('value')
-    if not domain:
-        print("Error: 'domain' not found in config.json")
-        sys.exit(1)
+    contacts_config = get_contacts(config)
+    contacts = [f"{v[1]}@{domain}" for v in contacts_config.values()]
 
-    users = config.get('users', {}).get('value', {})
-    replacement_emails = [f"{v[1]}@{domain}" for v in users.values()]
+    configured_seed = get_config_value(config, 'seed')
+    base_seed = manifest.base_seed(configured_seed) if manifest else configured_seed
+    config_hash = section_hash(email_config, domain, people_fingerprint(users), people_fingerprint(contacts_config), base_seed)
+    inputs = {'source_csv': input_fingerprint(csv_file)}
+
+    def rng_for(*parts):
+        return random.Random(derive_seed(base_seed, 'email', *parts)) if base_seed is not None else random
 
-    contacts_config = config.get('contacts', {}).get('value')
-    contacts = []
-    if contacts_config:
-        contacts = [f"{v[1]}@{domain}" for v in contacts_config.values()]
+    artifact_ids = mbox_artifact_ids(num_mbox_files)
+    shard = get_shard(config)
+    owned = [i for i, artifact_id in enumerate(artifact_ids) if not shard or shard.owns(artifact_id)]
+    stale = [i for i in owned
+             if not (manifest and manifest.is_fresh(artifact_ids[i], config_hash, inputs))]
+    metrics.incr("email_files_skipped", len(owned) - len(stale))
 
-    csv_file = os.path.join(script_dir, 'enron', 'emails.csv')
-    os.makedirs(args.output_dir, exist_ok=True)
+    def record_summary():
+        if manifest:
+            manifest.record('email', None, config_hash, seed=base_seed,
+                            inputs=shard_summary(shard, [artifact_ids[i] for i in owned], num_mbox_files))
 
-    all_samples = get_email_samples(csv_file, args.num_samples)
+    sink = open_sink(email_config, 'email', output_dir, shard)
+    try:
+        # Up-to-date files only need copying if output_dir or output_sink changed.
+        for i in owned:
+            if i not in stale:
+                keep_stored(sink, manifest, artifact_ids[i], artifact_ids[i])
+
+        if stale:
+            all_samples = get_email_samples(csv_file, num_samples, rng_for('sample'))
+
+            if len(all_samples) != num_samples:
+                raise ValueError(f"Expected {num_samples} samples, but got {len(all_samples)}.")
+
+            # Split the samples into chunks the way np.array_split would. Splitting the indices
+            # rather than the samples avoids copying every message into a fixed-width array as
+            # wide as the longest one.
+            bounds = np.cumsum([0] + [len(chunk) for chunk in np.array_split(np.arange(len(all_samples)), num_mbox_files)])
+            sample_chunks = [all_samples[bounds[i]:bounds[i + 1]] for i in range(num_mbox_files)]
+
+            for i in stale:
+                with sink.writer(artifact_ids[i]) as mbox_path:
+                    create_mbox_from_messages(sample_chunks[i], mbox_path, replacement_emails, contacts, rng_for('mbox', i))
+                sink.record(manifest, artifact_ids[i], artifact_ids[i], config_hash=config_hash, seed=base_seed, inputs=inputs)
+    finally:
+        sink.close()
+    record_summary()
 
-    if len(all_samples) == args.num_samples:
-        # Split the samples into chunks
-        sample_chunks = np.array_split(all_samples, args.num_mbox_files)
+    print("\nProcess complete." if stale else "All mbox files are up to date.")
+    return [sink.describe(artifact_ids[i]) for i in owned]
 
-        for i, chunk in enumerate(sample_chunks):
-            mbox_path = os.path.join(args.output_dir, f'samples_{i+1}.mbox')
-            create_mbox_from_messages(chunk.tolist(), mbox_path, replacement_emails, contacts)
+def plan_email(config):
+    """Plans generate_mailboxes' CSV scan and mbox files; every shard scans the whole CSV."""
+    email_config = config.get('email', {})
+    num_samples = get_config_value(email_config, 'num_samples', 1000)
+    num_mbox_files = get_config_value(email_config, 'num_mbox_files', 2)
+    csv_file = get_config_value(email_config, 'source_csv', DEFAULT_SOURCE_CSV)
+    shard = get_shard(config)
+    owned = sum(1 for artifact_id in mbox_artifact_ids(num_mbox_files) if not shard or shard.owns(artifact_id))
 
-        print("\nProcess complete.")
+    notes = []
+    csv_bytes = 0
+    if os.path.exists(csv_file):
+        csv_bytes = os.path.getsize(csv_file)
     else:
-        print(f"\nProcess failed: Expected {args.num_samples} samples, but got {len(all_samples)}.")
\ No newline at end of file
+        notes.append(f"The source CSV {csv_file} does not exist, so the email stage will fail.")
+    messages = round(num_samples * owned / num_mbox_files) if num_mbox_files else 0
+    return {
+        "jobs": {"mbox files": owned, "messages": messages},
+        "work": {"csv_bytes": csv_bytes, "messages": messages},
+        "outputs": {None: {"files": owned, "bytes": messages * MESSAGE_BYTES}},
+        "memory_bytes": num_samples * MESSAGE_BYTES + len(get_planned_users(config)) * ADDRESS_MEMORY_BYTES,
+        "notes": notes,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Create large mbox samples from a CSV file.")
+    parser.add_argument("--config", default=os.path.join(ROOT_DIR, 'config.json'), help="Path to the config file providing the domain, users and contacts.")
+    parser.add_argument("--num-samples", type=int, help="Total number of email samples to extract (default 10000).")
+    parser.add_argument("--output-dir", help="Directory to save the mbox files (default email/email_samples).")
+    parser.add_argument("--num-mbox-files", type=int, help="Number of mbox files to create.")
+    parser.add_argument("--source-csv", help="Path to the Enron emails.csv file.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.config):
+        print(f"Error: config file not found at {args.config}")
+        sys.exit(1)
+
+    config = load_config(args.config)
+    email_config = config.setdefault('email', {})
+    email_config.update(make_config(
+        num_samples=args.num_samples,
+        output_dir=args.output_dir,
+        num_mbox_files=args.num_mbox_files,
+        source_csv=args.source_csv,
+    ))
+    # Unless the config sets them, the script keeps its own defaults rather than generate_all.py's.
+    email_config.setdefault('num_samples', {"value": 10000})
+    email_config.setdefault('output_dir', {"value": "email/email_samples"})
+
+    try:
+        generate_mailboxes(config)
+    except ValueError as e:
+        print(f"\nProcess failed: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
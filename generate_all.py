@@ -11,136 +11,271 @@
 #      `"Y8888Y"'
 #
 
-import json
-import subprocess
 import argparse
+import importlib.util
+import json
 import os
+import sys
+import time
+from datetime import datetime, timezone
+import metrics
+from manifest import Manifest
+from orgconfig import ROOT_DIR, get_config_value, load_config
+from orgdata import PeopleFile, get_users
+from output_sink import sink_option
+from planner import build_plan, check_budgets, format_plan
+from scheduler import Stage, run_stages, summarize_results
+from sharding import Shard, find_shard_manifest_dirs, get_shard, verify_shards
+
+# The resource each stage is bound by, used to decide what may run side by side.
+STAGE_RESOURCES = {"org": "cpu", "calendar": "cpu", "email": "disk", "docs": "network"}
+
+# Each stage's generator script and the library function it exposes.
+GENERATORS = {
+    "org": ("org/synthesize_org.py", "synthesize_org"),
+    "calendar": ("calendar/generate_events.py", "generate_calendars"),
+    "email": ("email/create_large_mbox_samples.py", "generate_mailboxes"),
+    "docs": ("docs/generate_files.py", "generate_docs"),
+}
+
+# The function each stage's generator script exposes to plan a run without generating anything.
+PLANNERS = {"org": "plan_org", "calendar": "plan_calendar", "email": "plan_email", "docs": "plan_docs"}
+
+def load_generator_module(name):
+    """Imports a stage's generator script as a module.
+
+    The stage directories are not packages (and calendar/email would shadow the standard
+    library), so each script is loaded from its path under its own module name.
+    """
+    path, _ = GENERATORS[name]
+    module_name = os.path.splitext(os.path.basename(path))[0]
+    module = sys.modules.get(module_name)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT_DIR, path))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[module_name]
+            raise
+    return module
+
+def load_generator(name):
+    """Returns the library function a stage's generator script exposes."""
+    return getattr(load_generator_module(name), GENERATORS[name][1])
+
+def run_generator(name, generator, config, manifest=None):
+    """Runs one generator and returns the paths it wrote along with the metrics it recorded."""
+    artifacts = generator(config, manifest=manifest)
+    return {"artifacts": artifacts, "metrics": metrics.snapshot(prefix=f"{name}_")}
+
+def stage_dependencies(name, config):
+    """Returns the stages a stage waits for: its depends_on option, plus org when there is one."""
+    depends_on = list(get_config_value(config.get(name, {}), "depends_on", []))
+    # The other stages read the users and contacts the org stage writes.
+    if "org" in config and name != "org" and "org" not in depends_on:
+        depends_on.append("org")
+    return depends_on
+
+def build_stage(name, config, manifest=None):
+    """Wraps a stage's generator function in a Stage, applying any per-stage scheduling options."""
+    stage_config = config.get(name, {})
+    return Stage(
+        name, run_generator, args=(name, load_generator(name), config), kwargs={"manifest": manifest},
+        resource=get_config_value(stage_config, "resource", STAGE_RESOURCES[name]),
+        depends_on=stage_dependencies(name, config),
+        nice=get_config_value(stage_config, "nice"),
+        max_memory_mb=get_config_value(stage_config, "max_memory_mb"),
+    )
+
+def build_run_report(stages, results, started_at, wall_seconds):
+    """Collects each stage's exit code, duration and metrics into a JSON-serializable run report."""
+    report = {
+        "started_at": started_at.isoformat(),
+        "wall_seconds": wall_seconds,
+        "stages": {},
+    }
+    for stage in stages:
+        result = stage.result or {}
+        report["stages"][stage.name] = {
+            "exit_code": results.get(stage.name),
+            "duration_seconds": stage.duration,
+            "artifacts": len(result.get("artifacts") or []),
+            "metrics": result.get("metrics"),
+        }
+    return report
+
+def write_run_report(report, config):
+    """Writes the run report, appends it to the run history and, if configured, a Prometheus textfile."""
+    report_path = get_config_value(config, "report_path", "output/run_report.json")
+    history_path = get_config_value(config, "report_history_path", "output/run_history.jsonl")
+    prometheus_path = get_config_value(config, "prometheus_textfile")
+
+    metrics.write_json_report(report, report_path)
+    print(f"Run report written to {report_path}")
+    if history_path:
+        os.makedirs(os.path.dirname(history_path) or ".", exist_ok=True)
+        with open(history_path, "a") as f:
+            f.write(json.dumps(report, sort_keys=True) + "\n")
+    if prometheus_path:
+        metrics.write_prometheus_textfile(report, prometheus_path)
+        print(f"Prometheus metrics written to {prometheus_path}")
 
-def get_config_value(config, key, default=None):
-    """Gets a value from the config, supporting the new format."""
-    if key in config and "value" in config[key]:
-        return config[key]["value"]
-    return default
-
-def run_calendar_generator(domain, users, config):
-    print("--- Running Calendar Generator ---")
-    users_json = json.dumps(users)
-    months = get_config_value(config, "months_to_generate", 6)
-    num_events_range = get_config_value(config, "num_events_range", [20, 40])
-    location = get_config_value(config, "location", "Middle-earth")
-    shared_event_types = get_config_value(config, "shared_event_types", [])
-    solo_event_types = get_config_value(config, "solo_event_types", [])
-    output_dir = get_config_value(config, "output_dir", "output/calendar")
-
-    cmd = [
-        "python3", "calendar/generate_events.py",
-        "--domains", domain,
-        "--users", users_json,
-        "--months", str(months),
-        "--num-events", f'{num_events_range[0]},{num_events_range[1]}',
-        "--location", location,
-        "--shared-event-types", json.dumps(shared_event_types),
-        "--solo-event-types", json.dumps(solo_event_types),
-        "--output-dir", output_dir
-    ]
-    subprocess.run(cmd)
-
-def run_email_generator(config):
-    print("--- Running Email Generator ---")
-    num_samples = get_config_value(config, "num_samples", 1000)
-    output_dir = get_config_value(config, "output_dir", "output/email")
-    num_mbox_files = get_config_value(config, "num_mbox_files", 2)
-    cmd = [
-        "python3", "email/create_large_mbox_samples.py",
-        "--num-samples", str(num_samples),
-        "--output-dir", output_dir,
-        "--num-mbox-files", str(num_mbox_files)
-    ]
-    subprocess.run(cmd)
-
-def run_docs_generator(users, config, api_key=None):
-    print("--- Running Docs Generator ---")
-    user_list = " ".join(users.keys())
-    docs_config = config.get("docs", {})
-    num_files = get_config_value(docs_config, "num_files", 10)
-    org_name = get_config_value(docs_config, "org_name", "Shire Holdings")
-    theme = get_config_value(docs_config, "theme")
-    roles = get_config_value(docs_config, "roles", ["CEO", "CFO", "CTO", "HR_Manager", "Sales_Manager", "Marketing_Manager", "Project_Manager", "Accountant", "Software_Engineer", "Customer_Support_Specialist"])
-    file_types = get_config_value(docs_config, "file_types", ["document", "spreadsheet", "presentation", "image", "pdf"])
-    doc_types = get_config_value(docs_config, "doc_types", [
-        "Internal Memo", "Project Proposal", "Competitive Analysis", "Budget Report", "Meeting Minutes",
-        "Business Requirements Document (BRD)", "Standard Operating Procedure (SOP)", "Marketing Plan",
-        "Sales Strategy", "Quarterly Business Review (QBR)", "Press Release", "Employee Onboarding Checklist",
-        "Performance Improvement Plan (PIP)", "Job Description", "Offer Letter", "Vendor Contract",
-        "Non-Disclosure Agreement (NDA)", "Service Level Agreement (SLA)", "Incident Report", "Change Request Form"
-    ])
-    sheet_types = get_config_value(docs_config, "sheet_types", [
-        "Financial Statement", "Project Timeline", "Sales Tracker", "Inventory List", "Employee Directory",
-        "Budget vs. Actuals", "Marketing Campaign Tracker", "Customer Relationship Management (CRM) Data",
-        "Lead Generation Funnel", "Social Media Content Calendar", "Gantt Chart", "Resource Allocation Plan",
-        "Risk Register", "Issue Tracker", "Payroll Register", "Accounts Receivable Aging",
-        "Accounts Payable Aging", "Cash Flow Statement", "Burn Down Chart", "Capacity Planner"
-    ])
-    ppt_types = get_config_value(docs_config, "ppt_types", [
-        "Quarterly Review", "New Product Pitch", "Market Trend Analysis", "Team Training Guide",
-        "Sales Kick-Off (SKO) Presentation", "Investor Pitch Deck", "Company All-Hands Meeting",
-        "Project Kick-off Presentation", "Go-to-Market Strategy", "Customer Onboarding Guide",
-        "Product Demonstration", "Competitive Landscape Review", "Post-Mortem Analysis",
-        "Annual General Meeting (AGM) Presentation", "Change Management Communication", "Technology Roadmap",
-        "Financial Results Briefing", "HR Policy Overview", "Crisis Communication Plan", "Partner Program Overview"
-    ])
-    pdf_types = get_config_value(docs_config, "pdf_types", [
-        "Employee Manual", "Analyst Report", "User Guide", "Summary Report", "Design Guide",
-        "Invoice", "Purchase Order", "White Paper", "Case Study", "Annual Report",
-        "Compliance Certificate", "Legal Contract", "Technical Manual", "Product Brochure",
-        "Marketing eBook", "Signed Agreement", "Official Company Statement", "Terms of Service",
-        "Privacy Policy", "Security Whitepaper"
-    ])
-
-    cmd = [
-        "python3", "docs/generate_files.py",
-        "--users", user_list,
-        "--num-files", str(num_files),
-        "--org-name", org_name,
-        "--theme", theme,
-        "--roles", *roles,
-        "--file-types", json.dumps(file_types),
-        "--doc-types", json.dumps(doc_types),
-        "--sheet-types", json.dumps(sheet_types),
-        "--ppt-types", json.dumps(ppt_types),
-        "--pdf-types", json.dumps(pdf_types)
-    ]
-    if api_key:
-        cmd.extend(["--api-key", api_key])
-    subprocess.run(cmd)
+def merge_shards(manifest_dirs):
+    """Checks that the shard manifests union into a complete dataset and returns an exit code."""
+    print(f"--- Verifying {len(manifest_dirs)} shard manifests ---")
+    problems, totals = verify_shards(manifest_dirs)
+    for stage, count in sorted(totals.items()):
+        print(f"  {stage}: {count} artifacts")
+    if problems:
+        print("The shards do not merge into a complete dataset:")
+        for problem in problems:
+            print(f"  {problem}")
+        return 1
+    print("The shards merge into a complete, non-overlapping dataset.")
+    return 0
+
+def check_config(config, shard=None):
+    """Raises ValueError if a parsed config is incomplete or invalid for a run."""
+    # Every shard must derive the same seeds.
+    if shard and get_config_value(config, "seed") is None:
+        raise ValueError("a 'seed' must be set in the config file when sharding.")
+
+    domain = get_config_value(config, "domain")
+    users = get_users(config)
+
+    # With an org section, the users file does not exist until the org stage writes it.
+    if isinstance(users, PeopleFile) and "org" not in config and not users:
+        raise ValueError(f"The users file {users.path} does not exist or lists no users.")
+    if not domain or not (users or "org" in config):
+        raise ValueError("'domain' and either 'users', 'users_file' or an 'org' section must be defined in the config file.")
+    for name in GENERATORS:
+        if name in config:
+            sink_option(config[name], name)
+
+def prepare_stages(config, force=False, shard=None):
+    """Validates a parsed config and builds a Stage, with its manifest, for each configured stage.
+
+    Raises ValueError if the config is incomplete, and ImportError if a generator's
+    dependencies are missing.
+    """
+    check_config(config, shard)
+    manifest_dir = get_config_value(config, "manifest_dir", "output/.manifest")
+    if shard:
+        # Each shard keeps its own manifest.
+        config["shard"] = {"value": str(shard)}
+        manifest_dir = os.path.join(manifest_dir, shard.dirname())
+
+    stages = []
+    for name in GENERATORS:
+        if name not in config:
+            continue
+        manifest = Manifest(os.path.join(manifest_dir, f"{name}.jsonl"), reset=force)
+        if shard and manifest.meta.get("shard") != str(shard):
+            manifest.set_meta(shard=str(shard))
+        stages.append(build_stage(name, config, manifest))
+    return stages
+
+def plan_generation(config, shard=None, sequential=False):
+    """Expands a parsed config into a plan of a full run's work and cost, without writing anything. See planner.py."""
+    check_config(config, shard)
+    if shard:
+        config = dict(config, shard={"value": str(shard)})
+    stage_plans = {name: getattr(load_generator_module(name), PLANNERS[name])(config) for name in GENERATORS if name in config}
+    dependencies = {name: stage_dependencies(name, config) for name in stage_plans}
+    return build_plan(config, stage_plans, dependencies, sequential=sequential)
+
+def print_plan(config, shard=None, sequential=False):
+    """Prints the plan for a run and checks it against the config's budgets. Returns an exit code."""
+    shard_label = f" (shard {shard})" if shard else ""
+    print(f"--- Plan{shard_label} ---")
+    plan = plan_generation(config, shard=shard, sequential=sequential)
+    print("\n".join(format_plan(plan)))
+    problems = check_budgets(plan, config)
+    if problems:
+        print("The plan exceeds its budgets:")
+        for problem in problems:
+            print(f"  {problem}")
+        return 1
+    if "budgets" in config:
+        print("The plan is within its budgets.")
+    return 0
+
+def run_generation(config, force=False, sequential=False, shard=None, emit=None, on_finish=None, fork=None):
+    """Runs every stage configured in a parsed config and returns (exit code, run report).
+
+    emit, on_finish and fork are passed on to scheduler.run_stages. Raises ValueError if
+    the config or the stage graph is invalid, or the run's plan exceeds the config's
+    budgets, before anything is generated.
+    """
+    if "budgets" in config:
+        problems = check_budgets(plan_generation(config, shard=shard, sequential=sequential), config)
+        if problems:
+            raise ValueError("the run exceeds its budgets (see --plan):\n  " + "\n  ".join(problems))
+    stages = prepare_stages(config, force=force, shard=shard)
+    scheduler_config = config.get("scheduler", {})
+    max_parallel = 1 if sequential else get_config_value(scheduler_config, "max_parallel")
+    resource_limits = get_config_value(scheduler_config, "resource_limits", {})
+
+    shard_label = f" (shard {shard})" if shard else ""
+    print(f"--- Running stages{shard_label}: {', '.join(stage.name for stage in stages)} ---")
+    metrics.reset()
+    started_at = datetime.now(timezone.utc)
+    start = time.monotonic()
+    try:
+        results = run_stages(stages, resource_limits=resource_limits, max_parallel=max_parallel,
+                             emit=emit, on_finish=on_finish, fork=fork)
+    finally:
+        for stage in stages:
+            stage.kwargs["manifest"].close()
+    wall_seconds = time.monotonic() - start
+    exit_code, summary = summarize_results(results)
+    print("--- Stage summary ---")
+    print("\n".join(summary))
+    print(f"Total wall time: {wall_seconds:.1f}s")
+    report = build_run_report(stages, results, started_at, wall_seconds)
+    write_run_report(report, config)
+    return exit_code, report
 
 def main():
     parser = argparse.ArgumentParser(description="Generate all fake organization data.")
     parser.add_argument("--config", default="config.json", help="Path to the configuration file.")
+    parser.add_argument("--sequential", action="store_true", help="Run one stage at a time instead of concurrently.")
+    parser.add_argument("--force", action="store_true", help="Ignore the manifest and regenerate every artifact.")
+    parser.add_argument("--shard", help="Generate only one shard of the users' data, e.g. 2/8 for the second of eight.")
+    parser.add_argument("--merge-shards", nargs="*", metavar="MANIFEST_DIR",
+                        help="Check that the manifests of every shard form a complete dataset instead of generating. "
+                             "Defaults to the shard directories under manifest_dir.")
+    parser.add_argument("--plan", action="store_true",
+                        help="Print the work, API calls, tokens, runtime, disk and memory the run would need, "
+                             "check them against the budgets and exit without generating anything.")
     args = parser.parse_args()
 
     if not os.path.exists(args.config):
         print(f"Error: Config file not found at {args.config}")
         print("Please create a config.json file. You can use config.example.json as a template.")
-        return
+        sys.exit(1)
 
-    with open(args.config) as f:
-        config = json.load(f)
+    config = load_config(args.config)
 
-    domain = get_config_value(config, "domain")
-    users = get_config_value(config, "users")
-    api_key = get_config_value(config, "gemini_api_key")
-
-    if not domain or not users:
-        print("Error: 'domain' and 'users' must be defined in the config file.")
-        return
-
-    if "calendar" in config:
-        run_calendar_generator(domain, users, config.get("calendar", {}))
-    if "email" in config:
-        run_email_generator(config.get("email", {}))
-    if "docs" in config:
-        run_docs_generator(users, config, api_key)
+    if args.merge_shards is not None:
+        manifest_dir = get_config_value(config, "manifest_dir", "output/.manifest")
+        sys.exit(merge_shards(args.merge_shards or find_shard_manifest_dirs(manifest_dir)))
+
+    try:
+        shard = Shard.parse(args.shard) if args.shard else get_shard(config)
+        if args.plan:
+            sys.exit(print_plan(config, shard=shard, sequential=args.sequential))
+        exit_code, _ = run_generation(config, force=args.force, sequential=args.sequential, shard=shard)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    except ImportError as e:
+        print(f"Error: could not load a generator: {e}")
+        print("Make sure the dependencies are installed with: pip install -r requirements.txt")
+        sys.exit(1)
+    sys.exit(exit_code)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import random
+
+# Stage config keys that only affect how a stage is scheduled, not what it generates.
+SCHEDULING_KEYS = {"description", "resource", "depends_on", "nice", "max_memory_mb"}
+
+# Stage config keys that only say where outputs are stored. Changing them moves outputs
+# rather than regenerating them (see output_sink.keep_stored).
+STORAGE_KEYS = {"output_dir", "output_sink"}
+
+
+def file_checksum(path):
+    """Returns the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def config_hash(*parts):
+    """Returns a short, stable hash of JSON-serializable config values."""
+    encoded = json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def section_hash(section, *extra):
+    """Hashes a config section, ignoring scheduling and storage keys, together with any extra values."""
+    relevant = {key: value for key, value in section.items() if key not in SCHEDULING_KEYS | STORAGE_KEYS}
+    return config_hash(relevant, *extra)
+
+
+def derive_seed(base_seed, *parts):
+    """Derives a stable 64-bit seed for one artifact from the run's base seed."""
+    key = ":".join(str(part) for part in (base_seed, *parts)).encode("utf-8")
+    return int.from_bytes(hashlib.sha256(key).digest()[:8], "big")
+
+
+def input_fingerprint(path):
+    """Describes an input file cheaply (path, size, mtime) so changes to it can be detected."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return {"path": path, "missing": True}
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class Manifest:
+    """An append-only record of one stage's generated artifacts.
+
+    Each artifact is keyed by a stable id and records the config hash it was generated
+    from, its seed, its inputs and the checksum of its output. Entries are appended to a
+    JSON-lines journal as soon as each artifact is written, so a crashed run can resume
+    where it stopped. Later lines override earlier ones; the journal is compacted on load.
+    A read-only manifest is only loaded, for inspecting another run's results.
+    """
+
+    def __init__(self, path, reset=False, read_only=False):
+        self.path = path
+        self.entries = {}
+        self.meta = {}
+        if reset and os.path.exists(path):
+            os.remove(path)
+        self._load()
+        self._journal = None
+        if read_only:
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._compact()
+        self._journal = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A line cut short by a crash; the artifact will be regenerated.
+                if record.get("type") == "meta":
+                    self.meta.update(record["values"])
+                elif "id" in record:
+                    self.entries[record["id"]] = record
+
+    def _compact(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            if self.meta:
+                f.write(json.dumps({"type": "meta", "values": self.meta}) + "\n")
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(temp_path, self.path)
+
+    def _append(self, record):
+        if self._journal is None:
+            raise ValueError(f"The manifest {self.path} is read-only.")
+        self._journal.write(json.dumps(record) + "\n")
+        self._journal.flush()
+
+    def set_meta(self, **values):
+        """Stores run-level values, such as the base seed, alongside the artifacts."""
+        self.meta.update(values)
+        self._append({"type": "meta", "values": values})
+
+    def base_seed(self, configured=None):
+        """Returns the configured seed, or the one stored by a previous run, or a new random one."""
+        seed = configured if configured is not None else self.meta.get("seed")
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        if self.meta.get("seed") != seed:
+            self.set_meta(seed=seed)
+        return seed
+
+    def get(self, artifact_id):
+        return self.entries.get(artifact_id)
+
+    def is_fresh(self, artifact_id, config_hash, inputs=None):
+        """True if the artifact was generated successfully from the same config and inputs and is intact."""
+        entry = self.entries.get(artifact_id)
+        if not entry or entry.get("status") != "ok" or entry.get("config_hash") != config_hash:
+            return False
+        if inputs is not None and entry.get("inputs") != inputs:
+            return False
+        path = entry.get("path")
+        if path is None:
+            return True
+        if entry.get("archive"):
+            # Archived outputs are checked when the archive is read, not on every run; here
+            # only that their part is still the size it was closed at.
+            try:
+                return os.path.getsize(entry["archive"]) == entry.get("archive_size")
+            except OSError:
+                return False
+        return os.path.exists(path) and file_checksum(path) == entry.get("checksum")
+
+    def record(self, artifact_id, path, config_hash, seed=None, inputs=None, checksum=None, archive=None, archive_size=None):
+        """Records a successfully generated artifact. The checksum is computed if not given.
+
+        For an output stored in an archive (see output_sink.py), path is the member name
+        and archive_size the size of the completed archive part.
+        """
+        if path is not None and checksum is None:
+            checksum = file_checksum(path)
+        entry = {
+            "id": artifact_id, "status": "ok", "path": path, "config_hash": config_hash,
+            "seed": seed, "inputs": inputs, "checksum": checksum,
+        }
+        if archive:
+            entry["archive"] = archive
+            entry["archive_size"] = archive_size
+        self.entries[artifact_id] = entry
+        self._append(entry)
+
+    def record_failure(self, artifact_id, config_hash, seed=None, inputs=None, error=None):
+        """Records an artifact that could not be generated, so the next run retries it."""
+        entry = {
+            "id": artifact_id, "status": "failed", "path": None, "config_hash": config_hash,
+            "seed": seed, "inputs": inputs, "error": error,
+        }
+        self.entries[artifact_id] = entry
+        self._append(entry)
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
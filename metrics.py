@@ -0,0 +1,167 @@
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Quantiles reported for every histogram.
+QUANTILES = (0.5, 0.9, 0.99)
+
+# The process-wide registry. Generators record into it with incr(), set_gauge(), observe()
+# and timer(); generate_all.py collects a snapshot per stage for the run report. Metric
+# names are prefixed with the stage name, e.g. "email_rows_scanned".
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def incr(name, value=1, **labels):
+    """Adds value to a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    """Sets a gauge to value."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    """Records one observation (usually seconds or bytes) in a histogram."""
+    key = _key(name, labels)
+    with _lock:
+        _histograms.setdefault(key, []).append(value)
+
+
+@contextmanager
+def timer(name, **labels):
+    """Times the enclosed block and records the elapsed seconds in a histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def get_counter(name, **labels):
+    return _counters.get(_key(name, labels), 0)
+
+
+def reset():
+    """Clears every metric."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+def _quantile(sorted_values, q):
+    index = max(0, math.ceil(q * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(values):
+    """Summarizes histogram observations as count, sum, min, max, mean and quantiles."""
+    ordered = sorted(values)
+    summary = {
+        "count": len(ordered),
+        "sum": sum(ordered),
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": sum(ordered) / len(ordered),
+    }
+    for q in QUANTILES:
+        summary[f"p{int(q * 100)}"] = _quantile(ordered, q)
+    return summary
+
+
+def snapshot(prefix=""):
+    """Returns the metrics whose names start with prefix as a JSON-serializable dict."""
+    def entries(items, convert):
+        return [
+            {"name": name, "labels": dict(labels), **convert(value)}
+            for (name, labels), value in sorted(items.items()) if name.startswith(prefix)
+        ]
+
+    with _lock:
+        return {
+            "counters": entries(_counters, lambda value: {"value": value}),
+            "gauges": entries(_gauges, lambda value: {"value": value}),
+            "histograms": entries(_histograms, summarize),
+        }
+
+
+def _write_atomically(path, text):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def write_json_report(report, path):
+    """Writes a run report (see generate_all.build_run_report) as JSON."""
+    _write_atomically(path, json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+
+def _prometheus_labels(labels, **extra):
+    merged = {**labels, **extra}
+    if not merged:
+        return ""
+    parts = []
+    for key, value in sorted(merged.items()):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def write_prometheus_textfile(report, path, namespace="fake_org_gen"):
+    """Writes a run report's metrics in the Prometheus text format, for the node_exporter textfile collector."""
+    lines = []
+    seen_types = set()
+
+    def declare(name, kind):
+        if name not in seen_types:
+            lines.append(f"# TYPE {name} {kind}")
+            seen_types.add(name)
+
+    stages = sorted(report["stages"].items())
+    declare(f"{namespace}_stage_duration_seconds", "gauge")
+    for stage_name, stage in stages:
+        lines.append(f"{namespace}_stage_duration_seconds{_prometheus_labels({'stage': stage_name})} {stage.get('duration_seconds') or 0}")
+    declare(f"{namespace}_stage_exit_code", "gauge")
+    for stage_name, stage in stages:
+        exit_code = stage["exit_code"] if isinstance(stage["exit_code"], int) else -1
+        lines.append(f"{namespace}_stage_exit_code{_prometheus_labels({'stage': stage_name})} {exit_code}")
+
+    # Metric names carry their stage's prefix, so each family only appears under one stage.
+    for stage_name, stage in stages:
+        stage_metrics = stage.get("metrics") or {}
+        for counter in stage_metrics.get("counters", []):
+            name = f"{namespace}_{counter['name']}_total"
+            declare(name, "counter")
+            lines.append(f"{name}{_prometheus_labels(counter['labels'])} {counter['value']}")
+        for gauge in stage_metrics.get("gauges", []):
+            name = f"{namespace}_{gauge['name']}"
+            declare(name, "gauge")
+            lines.append(f"{name}{_prometheus_labels(gauge['labels'])} {gauge['value']}")
+        for histogram in stage_metrics.get("histograms", []):
+            name = f"{namespace}_{histogram['name']}"
+            declare(name, "summary")
+            for q in QUANTILES:
+                quantile_labels = _prometheus_labels(histogram["labels"], quantile=q)
+                lines.append(f"{name}{quantile_labels} {histogram[f'p{int(q * 100)}']}")
+            lines.append(f"{name}_sum{_prometheus_labels(histogram['labels'])} {histogram['sum']}")
+            lines.append(f"{name}_count{_prometheus_labels(histogram['labels'])} {histogram['count']}")
+
+    _write_atomically(path, "\n".join(lines) + "\n")
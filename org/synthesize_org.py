@@ -0,0 +1,250 @@
+import argparse
+import csv
+import os
+import sys
+import unicodedata
+import numpy as np
+from faker import Faker
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from orgconfig import get_config_value, load_config, make_config
+from orgdata import DEFAULT_CONTACTS_FILE, DEFAULT_NUM_USERS, DEFAULT_USERS_FILE, PEOPLE_FIELDS
+from manifest import derive_seed, section_hash
+from planner import PERSON_FILE_BYTES, PERSON_MEMORY_BYTES
+import metrics
+
+# Each department's head, the role of anyone in it who has reports, and the roles of
+# everyone else. Role names match the docs generator's roles where they can.
+DEFAULT_DEPARTMENTS = {
+    "Engineering": {"head": "CTO", "manager": "Project_Manager", "staff": ["Software_Engineer"]},
+    "Finance": {"head": "CFO", "manager": "Accountant", "staff": ["Accountant"]},
+    "Sales": {"head": "Sales_Manager", "manager": "Sales_Manager", "staff": ["Account_Executive", "Sales_Engineer"]},
+    "Marketing": {"head": "Marketing_Manager", "manager": "Marketing_Manager", "staff": ["Marketing_Specialist"]},
+    "Human Resources": {"head": "HR_Manager", "manager": "HR_Manager", "staff": ["Recruiter", "HR_Generalist"]},
+    "Customer Support": {"head": "Customer_Support_Manager", "manager": "Customer_Support_Manager", "staff": ["Customer_Support_Specialist"]},
+}
+
+# Faker is only called this many times per name part; people are drawn from the pools.
+DEFAULT_NAME_POOL_SIZE = 5000
+
+# Rows per csv.writer.writerows() call when streaming a people file.
+WRITE_BATCH_SIZE = 10000
+
+def _prefix_part(name):
+    """Lowercases a name part and reduces it to ASCII letters, for use in an email prefix."""
+    ascii_name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii").lower()
+    return "".join(c for c in ascii_name if c.isalpha()) or "x"
+
+def name_pool(generate, size):
+    """Calls a Faker method `size` times, so the pool keeps Faker's name frequencies."""
+    names = np.array([generate() for _ in range(size)], dtype=object)
+    parts = np.array([_prefix_part(name) for name in names], dtype=object)
+    return names, parts
+
+def occurrence_index(values):
+    """Returns, for each value, how many equal values come before it (0 for the first)."""
+    _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    order = np.argsort(inverse, kind="stable")
+    starts = np.cumsum(counts) - counts
+    occurrence = np.empty(len(values), dtype=np.int64)
+    occurrence[order] = np.arange(len(values)) - np.repeat(starts, counts)
+    return occurrence
+
+def synthesize_names(count, fake, rng, pool_size=DEFAULT_NAME_POOL_SIZE):
+    """Draws count full names with unique email prefixes like "jane.doe" and "jane.doe2".
+
+    Names are sampled from Faker-generated pools in one vectorized draw. Repeated prefixes
+    get a number appended by their occurrence; numbered prefixes cannot collide with plain
+    ones, which only contain letters and a dot.
+    """
+    size = max(1, min(count, pool_size))
+    first_names, first_parts = name_pool(fake.first_name, size)
+    last_names, last_parts = name_pool(fake.last_name, size)
+    first = rng.integers(0, size, count)
+    last = rng.integers(0, size, count)
+
+    full_names = first_names[first] + " " + last_names[last]
+    prefixes = first_parts[first] + "." + last_parts[last]
+    occurrence = occurrence_index(prefixes)
+    collided = occurrence > 0
+    prefixes[collided] = prefixes[collided] + (occurrence[collided] + 1).astype(str).astype(object)
+    metrics.incr("org_prefix_collisions", int(collided.sum()))
+    return full_names, prefixes
+
+def build_hierarchy(count, departments, span_of_control, rng):
+    """Assigns departments, roles and managers to count people, as arrays indexed by person.
+
+    Person 0 is the CEO and persons 1..D head the D departments. Everyone else joins a
+    random department, where the k-th member reports to member (k - 1) // span_of_control,
+    member 0 being the head. Managers are -1 for the CEO.
+    """
+    names = list(departments)[:max(0, count - 1)]
+    num_departments = len(names)
+    department = np.full(count, -1, dtype=np.int64)
+    manager = np.full(count, -1, dtype=np.int64)
+    roles = np.empty(count, dtype=object)
+    if count == 0:
+        return department, roles, manager
+    roles[0] = "CEO"
+
+    heads = np.arange(1, num_departments + 1)
+    department[heads] = np.arange(num_departments)
+    manager[heads] = 0
+    roles[heads] = [departments[name]["head"] for name in names]
+
+    staff = np.arange(num_departments + 1, count)
+    if num_departments == 0 or not len(staff):
+        return department, roles, manager
+
+    staff_department = rng.integers(0, num_departments, len(staff))
+    department[staff] = staff_department
+    order = np.argsort(staff_department, kind="stable")
+    sizes = np.bincount(staff_department, minlength=num_departments)
+    starts = np.cumsum(sizes) - sizes
+    ordinal = np.empty(len(staff), dtype=np.int64)
+    ordinal[order] = np.arange(len(staff)) - np.repeat(starts, sizes) + 1
+
+    manager_ordinal = (ordinal - 1) // span_of_control
+    manager_position = np.maximum(starts[staff_department] + manager_ordinal - 1, 0)
+    manager[staff] = np.where(manager_ordinal == 0, 1 + staff_department, staff[order[manager_position]])
+
+    has_reports = ordinal * span_of_control + 1 <= sizes[staff_department]
+    for d, name in enumerate(names):
+        in_department = staff_department == d
+        staff_roles = np.array(departments[name]["staff"], dtype=object)
+        department_roles = staff_roles[rng.integers(0, len(staff_roles), int(in_department.sum()))]
+        department_roles[has_reports[in_department]] = departments[name]["manager"]
+        roles[staff[in_department]] = department_roles
+    return department, roles, manager
+
+def write_people(path, keys, full_names, prefixes, roles=None, departments=None, managers=None):
+    """Streams people to a CSV file in batches and returns the number of bytes written.
+
+    The file is written to a temporary path and moved into place, so readers never see
+    a partial file.
+    """
+    count = len(keys)
+    blank = np.full(count, "", dtype=object)
+    columns = [keys, full_names, prefixes,
+               blank if roles is None else roles,
+               blank if departments is None else departments,
+               blank if managers is None else managers]
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(PEOPLE_FIELDS)
+        for start in range(0, count, WRITE_BATCH_SIZE):
+            writer.writerows(zip(*(column[start:start + WRITE_BATCH_SIZE] for column in columns)))
+    os.replace(temp_path, path)
+    size = os.path.getsize(path)
+    metrics.incr("org_files_written")
+    metrics.incr("org_bytes_written", size)
+    return size
+
+def synthesize_org(config, manifest=None):
+    """Generates users (with roles, departments and managers) and contacts from a parsed config.
+
+    Writes the users_file and contacts_file the other generators read, and returns their
+    paths. With a manifest, files that are already up to date are left alone, so the
+    people the other stages were generated for stay the same between runs.
+    """
+    org_config = config.get("org", {})
+    num_users = get_config_value(org_config, "num_users", DEFAULT_NUM_USERS)
+    num_contacts = get_config_value(org_config, "num_contacts", 0)
+    departments = get_config_value(org_config, "departments", DEFAULT_DEPARTMENTS)
+    span_of_control = get_config_value(org_config, "span_of_control", 8)
+    locale = get_config_value(org_config, "locale", "en_US")
+    pool_size = get_config_value(org_config, "name_pool_size", DEFAULT_NAME_POOL_SIZE)
+    users_file = get_config_value(config, "users_file", DEFAULT_USERS_FILE)
+    contacts_file = get_config_value(config, "contacts_file", DEFAULT_CONTACTS_FILE)
+    if num_users < 1 or num_contacts < 0:
+        raise ValueError("'org.num_users' must be at least 1 and 'org.num_contacts' cannot be negative.")
+    if span_of_control < 1:
+        raise ValueError("'org.span_of_control' must be at least 1.")
+
+    configured_seed = get_config_value(config, "seed")
+    base_seed = manifest.base_seed(configured_seed) if manifest else configured_seed
+    config_hash = section_hash(org_config, base_seed)
+
+    outputs = {"users": users_file}
+    if num_contacts:
+        outputs["contacts"] = contacts_file
+    if manifest and all(manifest.is_fresh(artifact_id, config_hash) for artifact_id in outputs):
+        print("The users and contacts files are up to date.")
+        return list(outputs.values())
+
+    seed = derive_seed(base_seed, "org") if base_seed is not None else None
+    rng = np.random.default_rng(seed)
+    fake = Faker(locale)
+    if seed is not None:
+        fake.seed_instance(seed)
+
+    print(f"Generating {num_users} users and {num_contacts} contacts...")
+    with metrics.timer("org_synthesis_seconds"):
+        # Users and contacts share one draw, so their email prefixes are unique across both.
+        full_names, prefixes = synthesize_names(num_users + num_contacts, fake, rng, pool_size)
+        keys = np.char.replace(prefixes.astype(str), ".", "_").astype(object)
+        department, roles, manager = build_hierarchy(num_users, departments, span_of_control, rng)
+    metrics.incr("org_people_generated", num_users + num_contacts)
+
+    department_names = np.array(["Executive", *departments], dtype=object)[department + 1]
+    manager_keys = np.where(manager >= 0, keys[:num_users][np.maximum(manager, 0)], "")
+    size = write_people(users_file, keys[:num_users], full_names[:num_users], prefixes[:num_users],
+                        roles, department_names, manager_keys)
+    print(f"Wrote {num_users} users ({size / 1e6:.1f} MB) to {users_file}")
+    if manifest:
+        manifest.record("users", users_file, config_hash, seed=seed)
+
+    if num_contacts:
+        size = write_people(contacts_file, keys[num_users:], full_names[num_users:], prefixes[num_users:])
+        print(f"Wrote {num_contacts} contacts ({size / 1e6:.1f} MB) to {contacts_file}")
+        if manifest:
+            manifest.record("contacts", contacts_file, config_hash, seed=seed)
+    return list(outputs.values())
+
+def plan_org(config):
+    """Plans synthesize_org's people and files for a parsed config."""
+    org_config = config.get("org", {})
+    num_users = get_config_value(org_config, "num_users", DEFAULT_NUM_USERS)
+    num_contacts = get_config_value(org_config, "num_contacts", 0)
+    people = num_users + num_contacts
+    return {
+        "jobs": {"users": num_users, "contacts": num_contacts},
+        "work": {"people": people},
+        "outputs": {None: {"files": 1 + bool(num_contacts), "bytes": people * PERSON_FILE_BYTES}},
+        "memory_bytes": people * PERSON_MEMORY_BYTES,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a large synthetic organization: users with roles, departments and managers, plus contacts.")
+    parser.add_argument("--config", help="Path to a config file. Other arguments override its values.")
+    parser.add_argument("--num-users", type=int, help="Number of users to generate (default 100).")
+    parser.add_argument("--num-contacts", type=int, help="Number of external contacts to generate (default 0).")
+    parser.add_argument("--span-of-control", type=int, help="Maximum direct reports per manager (default 8).")
+    parser.add_argument("--locale", help="Faker locale for names (default en_US).")
+    parser.add_argument("--users-file", help="Where to write the users file.")
+    parser.add_argument("--contacts-file", help="Where to write the contacts file.")
+    parser.add_argument("--seed", type=int, help="Random seed.")
+    args = parser.parse_args()
+
+    config = load_config(args.config) if args.config else {}
+    config.update(make_config(users_file=args.users_file, contacts_file=args.contacts_file, seed=args.seed))
+    config.setdefault("org", {}).update(make_config(
+        num_users=args.num_users,
+        num_contacts=args.num_contacts,
+        span_of_control=args.span_of_control,
+        locale=args.locale,
+    ))
+
+    try:
+        synthesize_org(config)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
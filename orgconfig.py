@@ -0,0 +1,23 @@
+import json
+import os
+
+# The repository root, used to resolve the default config and data paths.
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_config_value(config, key, default=None):
+    """Gets a value from the config, supporting the new format."""
+    if key in config and "value" in config[key]:
+        return config[key]["value"]
+    return default
+
+
+def load_config(path):
+    """Loads a config file in the {"key": {"description": ..., "value": ...}} format."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def make_config(**values):
+    """Builds a config section from plain values, skipping any that are None."""
+    return {key: {"value": value} for key, value in values.items() if value is not None}
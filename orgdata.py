@@ -0,0 +1,117 @@
+import csv
+import os
+from collections.abc import Mapping
+
+from manifest import file_checksum
+from orgconfig import get_config_value
+
+# Columns of a users or contacts file written by org/synthesize_org.py.
+PEOPLE_FIELDS = ["key", "full_name", "email_prefix", "role", "department", "manager"]
+
+# Where the org stage writes its files unless users_file or contacts_file say otherwise.
+DEFAULT_USERS_FILE = "output/org/users.csv"
+DEFAULT_CONTACTS_FILE = "output/org/contacts.csv"
+
+# How many users the org stage generates unless org.num_users says otherwise.
+DEFAULT_NUM_USERS = 100
+
+
+class PeopleFile(Mapping):
+    """A users or contacts CSV file, read lazily and exposed like the inline config format.
+
+    people[key] returns [full_name, email_prefix], just like an entry of the inline
+    "users" map, so generators can use either interchangeably. Iterating over the keys
+    streams the file without loading it; anything else loads it once on first use.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._people = None
+
+    def _rows(self):
+        with open(self.path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+
+    def _load(self):
+        if self._people is None:
+            self._people = {
+                row["key"]: (row["full_name"], row["email_prefix"], row.get("role") or None,
+                             row.get("department") or None, row.get("manager") or None)
+                for row in self._rows()
+            }
+        return self._people
+
+    def __getitem__(self, key):
+        full_name, prefix = self._load()[key][:2]
+        return [full_name, prefix]
+
+    def __iter__(self):
+        if self._people is not None:
+            return iter(self._people)
+        return (row["key"] for row in self._rows())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __bool__(self):
+        # Checking whether users are configured should not read the whole file, only its first row.
+        if self._people is not None:
+            return bool(self._people)
+        return os.path.exists(self.path) and next(self._rows(), None) is not None
+
+    def details(self, key):
+        """Returns everything the file records about a person, including role, department and manager."""
+        return dict(zip(PEOPLE_FIELDS, (key, *self._load()[key])))
+
+
+def get_people(config, kind):
+    """Returns the config's "users" or "contacts": the inline map if given, else its "<kind>_file".
+
+    With an "org" section, the file defaults to where the org stage writes it.
+    """
+    inline = get_config_value(config, kind)
+    if inline:
+        return inline
+    default = DEFAULT_USERS_FILE if kind == "users" else DEFAULT_CONTACTS_FILE
+    path = get_config_value(config, f"{kind}_file", default if "org" in config else None)
+    if path and (kind == "users" or os.path.exists(path)):
+        return PeopleFile(path)
+    return {}
+
+
+def get_users(config):
+    return get_people(config, "users")
+
+
+def get_contacts(config):
+    return get_people(config, "contacts")
+
+
+def org_generates_users(config):
+    """True if the users come from the org stage, rather than being listed or read from a file."""
+    return "org" in config and not get_config_value(config, "users")
+
+
+def get_planned_users(config):
+    """Returns the users a run will generate data for, with placeholders for those the org stage has yet to create."""
+    if org_generates_users(config):
+        num_users = get_config_value(config["org"], "num_users", DEFAULT_NUM_USERS)
+        return {f"user{i + 1}": [f"User {i + 1}", f"user.{i + 1}"] for i in range(num_users)}
+    users = get_users(config)
+    if isinstance(users, PeopleFile) and not os.path.exists(users.path):
+        raise ValueError(f"The users file {users.path} does not exist.")
+    return users
+
+
+def get_role(people, key):
+    """Returns the role recorded for a person in a people file, or None for inline users."""
+    if isinstance(people, PeopleFile):
+        return people.details(key)["role"]
+    return None
+
+
+def people_fingerprint(people):
+    """Returns a JSON-serializable value that changes whenever the people change, for config hashes."""
+    if isinstance(people, PeopleFile):
+        return {"path": people.path, "sha256": file_checksum(people.path)}
+    return people
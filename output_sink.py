@@ -0,0 +1,385 @@
+import glob
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from contextlib import contextmanager
+
+from manifest import file_checksum
+from orgconfig import get_config_value
+
+# File name extension of each archive backend.
+ARCHIVE_EXTENSIONS = {"tar": ".tar", "tar.gz": ".tar.gz", "tar.zst": ".tar.zst", "zip": ".zip"}
+
+SINK_TYPES = ("directory", *ARCHIVE_EXTENSIONS)
+
+# Files per archive part when the output_sink sets no fsync_every. A crash loses the part
+# being written, so the stages whose files are slow or paid for to regenerate close parts often.
+DEFAULT_PART_FILES = {"calendar": 1000, "email": 1, "docs": 5}
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DirectorySink:
+    """Writes each output as a loose file under a root directory, the way the generators always have.
+
+    With fsync_every, written files (and their directories) are fsynced in batches of
+    that many files rather than one at a time.
+    """
+
+    archive = None
+
+    def __init__(self, root, fsync_every=None):
+        self.root = root
+        self.fsync_every = fsync_every
+        self._pending = []
+
+    def path_of(self, name):
+        """Where the output called name is (or would be) stored."""
+        return os.path.join(self.root, name)
+
+    def exists(self, name):
+        return os.path.exists(self.path_of(name))
+
+    @contextmanager
+    def writer(self, name):
+        """Yields the path to write the output called name to. It is stored when the block exits."""
+        path = self.path_of(name)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        yield path
+        if self.fsync_every and os.path.exists(path):
+            self._pending.append(path)
+            if len(self._pending) >= self.fsync_every:
+                self._sync()
+
+    def locate(self, name):
+        """The manifest fields that locate a stored output: its path, plus checksum and archive for archives."""
+        return {"path": self.path_of(name)}
+
+    def describe(self, name):
+        return self.path_of(name)
+
+    def holds(self, name, entry):
+        """True if a manifest entry says the output called name is stored in this sink."""
+        return not entry.get("archive") and entry.get("path") == self.path_of(name)
+
+    def checksum(self, name):
+        """The checksum of the stored output called name."""
+        return file_checksum(self.path_of(name))
+
+    def record(self, manifest, artifact_id, name, **fields):
+        """Records the output called name in the manifest, if there is one."""
+        if manifest is not None:
+            manifest.record(artifact_id, **fields, **self.locate(name))
+
+    def _sync(self):
+        for path in self._pending:
+            _fsync_path(path)
+        for directory in {os.path.dirname(path) or "." for path in self._pending}:
+            _fsync_path(directory)
+        self._pending = []
+
+    def close(self):
+        if self._pending:
+            self._sync()
+
+
+class _ArchiveSink:
+    """Streams outputs into an archive, with a JSON-lines index of where each one is.
+
+    Each run that writes anything adds numbered parts next to the configured path (e.g.
+    calendar-00002.tar.zst for calendar.tar.zst) rather than rewriting earlier parts, so an
+    incremental run only stores what it regenerated. The index, calendar.index.jsonl, lists
+    every member with its part, the part's final size, its header offset (in the
+    uncompressed stream), size and checksum; later lines override earlier ones. Members are
+    only indexed, and recorded in the manifest, once their part has been closed and synced,
+    so a crash loses at most the part being written. A new part is started every
+    fsync_every files. Outputs are written to a staging file first, because
+    the generators' libraries write to paths, and streamed into the archive when complete.
+    """
+
+    def __init__(self, path, extension, fsync_every=None):
+        self.base = path[:-len(extension)] if path.endswith(extension) else path
+        self.extension = extension
+        self.fsync_every = fsync_every
+        self.index_path = f"{self.base}.index.jsonl"
+        self.archive = None
+        self._names = {}
+        self._indexed_parts = set()
+        self._pending = {}
+        self._staging = None
+        self._index = None
+        if os.path.exists(self.index_path):
+            self._names = read_index(self.index_path)
+            self._indexed_parts = {entry["part"] for entry in _read_index_lines(self.index_path)}
+
+    def _parts(self):
+        return glob.glob(f"{glob.escape(self.base)}-[0-9][0-9][0-9][0-9][0-9]{self.extension}")
+
+    def _next_part(self):
+        numbers = [0] + [int(part[len(self.base) + 1:len(self.base) + 6]) for part in self._parts()]
+        return f"{self.base}-{max(numbers) + 1:05d}{self.extension}"
+
+    def _clean_up(self, directory):
+        """Removes what a crashed run left behind: its staging directory and parts that were never indexed."""
+        for staging in glob.glob(os.path.join(glob.escape(directory), f".{glob.escape(os.path.basename(self.base))}.staging-*")):
+            shutil.rmtree(staging, ignore_errors=True)
+        for part in self._parts():
+            if os.path.basename(part) not in self._indexed_parts:
+                os.remove(part)
+
+    def _open(self):
+        directory = os.path.dirname(self.base) or "."
+        os.makedirs(directory, exist_ok=True)
+        if self._staging is None:
+            self._clean_up(directory)
+            self._staging = tempfile.mkdtemp(prefix=f".{os.path.basename(self.base)}.staging-", dir=directory)
+        self.archive = self._next_part()
+        self._raw = open(self.archive, "wb")
+        self._open_archive(self._raw)
+
+    def path_of(self, name):
+        return name
+
+    def exists(self, name):
+        return name in self._names
+
+    @contextmanager
+    def writer(self, name):
+        if self.archive is None:
+            self._open()
+        path = os.path.join(self._staging, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            yield path
+            if os.path.exists(path):
+                self._store(name, path)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _store(self, name, path):
+        checksum = file_checksum(path)
+        offset = self._add(name, path)
+        entry = {"name": name, "part": os.path.basename(self.archive), "offset": offset,
+                 "size": os.path.getsize(path), "sha256": checksum}
+        self._names[name] = entry
+        self._pending[name] = [entry, None]
+
+    def record(self, manifest, artifact_id, name, **fields):
+        """Records the output called name in the manifest once its part is closed and synced."""
+        if name in self._pending:
+            self._pending[name][1] = (manifest, artifact_id, fields)
+        if self.fsync_every and len(self._pending) >= self.fsync_every:
+            self._finish_part()
+
+    def _finish_part(self):
+        """Closes and syncs the current part, then indexes its members and records them in the manifest."""
+        self._close_archive()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        part_size = os.path.getsize(self.archive)
+        self.archive = None
+
+        if self._index is None:
+            self._index = open(self.index_path, "a", encoding="utf-8")
+        for entry, _ in self._pending.values():
+            entry["part_size"] = part_size
+            self._index.write(json.dumps(entry) + "\n")
+            self._indexed_parts.add(entry["part"])
+        self._index.flush()
+        os.fsync(self._index.fileno())
+
+        pending, self._pending = self._pending, {}
+        for entry, recording in pending.values():
+            if recording and recording[0] is not None:
+                manifest, artifact_id, fields = recording
+                manifest.record(artifact_id, **fields, **self.locate(entry["name"]))
+
+    def locate(self, name):
+        entry = self._names[name]
+        return {"path": name, "checksum": entry["sha256"],
+                "archive": os.path.join(os.path.dirname(self.base), entry["part"]),
+                "archive_size": entry.get("part_size")}
+
+    def describe(self, name):
+        return describe_entry(self.locate(name))
+
+    def holds(self, name, entry):
+        return (bool(entry.get("archive")) and name in self._names
+                and os.path.normpath(self.locate(name)["archive"]) == os.path.normpath(entry["archive"]))
+
+    def checksum(self, name):
+        return self._names[name]["sha256"]
+
+    def close(self):
+        if self.archive is not None:
+            self._finish_part()
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        if self._staging is not None:
+            shutil.rmtree(self._staging, ignore_errors=True)
+            self._staging = None
+
+
+class TarSink(_ArchiveSink):
+    """A streaming tar archive, optionally compressed with gzip or (with the zstandard package) zstd."""
+
+    def __init__(self, path, compression=None, fsync_every=None):
+        self.compression = compression
+        super().__init__(path, ".tar" + (f".{compression}" if compression else ""), fsync_every)
+
+    def _open_archive(self, raw):
+        self._zstd = None
+        fileobj = raw
+        if self.compression == "zst":
+            import zstandard
+            self._zstd = zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+            fileobj = self._zstd
+        mode = "w|gz" if self.compression == "gz" else "w|"
+        self._tar = tarfile.open(fileobj=fileobj, mode=mode)
+
+    def _add(self, name, path):
+        info = self._tar.gettarinfo(path, arcname=name)
+        info.uid = info.gid = 0
+        info.mtime = int(info.mtime)
+        info.uname = info.gname = ""
+        offset = self._tar.offset
+        with open(path, "rb") as f:
+            self._tar.addfile(info, f)
+        return offset
+
+    def _close_archive(self):
+        self._tar.close()
+        if self._zstd is not None:
+            self._zstd.close()
+
+
+class ZipSink(_ArchiveSink):
+    """A deflate-compressed zip archive."""
+
+    def __init__(self, path, fsync_every=None):
+        super().__init__(path, ".zip", fsync_every)
+
+    def _open_archive(self, raw):
+        self._zip = zipfile.ZipFile(raw, "w", zipfile.ZIP_DEFLATED)
+
+    def _add(self, name, path):
+        self._zip.write(path, arcname=name)
+        return self._zip.getinfo(name).header_offset
+
+    def _close_archive(self):
+        self._zip.close()
+
+
+def _read_index_lines(index_path):
+    with open(index_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue  # A line cut short by a crash.
+
+
+def read_index(index_path):
+    """Returns the latest index entry for each member of an archive sink."""
+    return {entry["name"]: entry for entry in _read_index_lines(index_path)}
+
+
+def describe_entry(entry):
+    """A readable location for a manifest entry: a path, or archive:member for archived outputs."""
+    if entry.get("archive"):
+        return f"{entry['archive']}:{entry['path']}"
+    return entry["path"]
+
+
+def open_stored(entry):
+    """Opens the output a manifest entry locates for reading, from its archive part if it has one."""
+    archive = entry.get("archive")
+    if not archive:
+        return open(entry["path"], "rb")
+    if archive.endswith(".zip"):
+        with zipfile.ZipFile(archive) as z:
+            return z.open(entry["path"])
+    if archive.endswith(".tar.zst"):
+        import zstandard
+        with open(archive, "rb") as raw, tarfile.open(fileobj=zstandard.ZstdDecompressor().stream_reader(raw), mode="r|") as tar:
+            for info in tar:
+                if info.name == entry["path"]:
+                    return io.BytesIO(tar.extractfile(info).read())
+        raise FileNotFoundError(f"{entry['path']} is not in {archive}")
+    with tarfile.open(archive) as tar:
+        return io.BytesIO(tar.extractfile(entry["path"]).read())
+
+
+def keep_stored(sink, manifest, artifact_id, name):
+    """Keeps an up-to-date artifact, copying it into the sink if output_dir or output_sink changed since it was generated."""
+    entry = manifest.get(artifact_id)
+    if sink.holds(name, entry):
+        return
+    fields = {"config_hash": entry["config_hash"], "seed": entry.get("seed"), "inputs": entry.get("inputs")}
+    if sink.exists(name) and sink.checksum(name) == entry.get("checksum"):
+        # Switched back to where an earlier run stored it.
+        manifest.record(artifact_id, **fields, **sink.locate(name))
+        return
+    with open_stored(entry) as source, sink.writer(name) as path:
+        with open(path, "wb") as f:
+            shutil.copyfileobj(source, f)
+    sink.record(manifest, artifact_id, name, **fields)
+
+
+def sink_option(stage_config, stage_name):
+    """Returns a stage's "output_sink" option as a dict with a "type", raising ValueError if it is invalid.
+
+    The option is a sink type ("directory", "tar", "tar.gz", "tar.zst" or "zip") or an
+    object with a "type" and optionally a "path" and "fsync_every".
+    """
+    option = get_config_value(stage_config, "output_sink", "directory")
+    if isinstance(option, str):
+        option = {"type": option}
+    if not isinstance(option, dict):
+        raise ValueError(f"The output_sink for {stage_name} must be a sink type or an object with a 'type'.")
+    option = {"type": "directory", **option}
+    if option["type"] not in SINK_TYPES:
+        raise ValueError(f"Unknown output_sink type '{option['type']}' for {stage_name}; expected one of {', '.join(SINK_TYPES)}.")
+    if option["type"] == "tar.zst":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("The tar.zst output sink needs the zstandard package: pip install zstandard") from None
+    return option
+
+
+def open_sink(stage_config, stage_name, output_dir, shard=None):
+    """Returns the sink a stage writes its outputs to, from its "output_sink" option.
+
+    Archives default to <output_dir>/<stage_name>.<extension>. On a shard, the shard's
+    name is added to the archive's (e.g. calendar.shard-2-of-8.tar), so shards never
+    write to the same parts.
+    """
+    option = sink_option(stage_config, stage_name)
+    sink_type = option["type"]
+    fsync_every = option.get("fsync_every")
+    if sink_type == "directory":
+        return DirectorySink(option.get("path", output_dir), fsync_every)
+
+    fsync_every = fsync_every or DEFAULT_PART_FILES.get(stage_name, 1000)
+    extension = ARCHIVE_EXTENSIONS[sink_type]
+    path = option.get("path") or os.path.join(output_dir, f"{stage_name}{extension}")
+    if shard:
+        base = path[:-len(extension)] if path.endswith(extension) else path
+        path = f"{base}.{shard.dirname()}{extension}"
+    if sink_type == "zip":
+        return ZipSink(path, fsync_every)
+    return TarSink(path, sink_type[4:] or None, fsync_every)
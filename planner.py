@@ -0,0 +1,351 @@
+import itertools
+import json
+import os
+
+from orgconfig import ROOT_DIR, get_config_value
+
+# Memory a stage's process holds before it generates anything: the interpreter and the
+# generator libraries, which are all imported before the stages are forked.
+BASE_MEMORY_MB = 150
+
+# Seconds per Gemini call when no earlier run has measured the latency.
+DEFAULT_SECONDS_PER_CALL = 10.0
+
+DEFAULT_BENCHMARK_RESULTS = os.path.join(ROOT_DIR, "benchmarks", "results.json")
+
+# Typical sizes, measured on small runs, that the generators' plan_* functions estimate
+# output and memory from until the run history has real bytes per file and tokens per call.
+PERSON_FILE_BYTES = 90
+PERSON_MEMORY_BYTES = 600
+USER_MEMORY_BYTES = 300
+ICS_HEADER_BYTES = 100
+EVENT_FILE_BYTES = 450
+EVENT_MEMORY_BYTES = 1500
+MESSAGE_BYTES = 2800  # emails.csv holds about 517,000 messages in 1.4 GB.
+ADDRESS_MEMORY_BYTES = 100
+DOCS_FILE_BYTES = {"document": 37_000, "spreadsheet": 6_000, "presentation": 30_000, "image": 1_500_000, "pdf": 3_000}
+DOCS_OUTPUT_TOKENS = {"document": 800, "spreadsheet": 450, "presentation": 300, "image": 100, "pdf": 800}
+DOCS_RENDER_MEMORY_BYTES = 20_000_000
+IMAGE_OUTPUT_TOKENS = 1290  # What Gemini counts a generated image as.
+CHARS_PER_TOKEN = 4
+
+# The run-report counter and timer that measure each unit of planned work, and the benchmark to fall back on.
+RUNTIME_SOURCES = {
+    "org": {
+        "people": {"counter": "org_people_generated", "timer": "org_synthesis_seconds", "benchmark": ("org_users", None)},
+    },
+    "calendar": {
+        "events": {"counter": "calendar_events_generated", "timer": "calendar_event_generation_seconds",
+                   "benchmark": ("calendar_event_definitions", None)},
+        "files": {"counter": "calendar_files_written", "timer": "calendar_ics_render_seconds",
+                  "benchmark": ("calendar_ics_write", None)},
+    },
+    "email": {
+        "csv_bytes": {"counter": "email_csv_bytes_scanned", "timer": "email_csv_scan_seconds",
+                      "benchmark": ("email_csv_sampling", "csv_bytes")},
+        "messages": {"counter": "email_messages_written", "timer": "email_mbox_write_seconds",
+                     "benchmark": ("email_mbox_write", None)},
+    },
+    "docs": {
+        "api_calls": {"counter": None, "timer": "docs_llm_latency_seconds", "default": DEFAULT_SECONDS_PER_CALL},
+        "files": {"counter": "docs_files_written", "timer": "docs_render_seconds", "benchmark": ("docs_{label}_render", None)},
+    },
+}
+
+
+def load_run_history(path):
+    """Returns the run reports appended to a run history file, newest first."""
+    if not path or not os.path.exists(path):
+        return []
+    reports = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                reports.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # A line cut short by a crash.
+    reports.reverse()
+    return reports
+
+
+def load_benchmark_results(path):
+    """Returns the results written by benchmarks/run_benchmarks.py, or an empty list."""
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("results", [])
+
+
+def _matching(entries, name, label):
+    return [entry for entry in entries if entry["name"] == name and (label is None or label in entry["labels"].values())]
+
+
+def _stage_metrics(history, stage):
+    for report in history:
+        stage_metrics = (report.get("stages", {}).get(stage) or {}).get("metrics")
+        if stage_metrics:
+            yield stage_metrics
+
+
+def _history_rate(history, stage, source, label):
+    for stage_metrics in _stage_metrics(history, stage):
+        timers = _matching(stage_metrics["histograms"], source["timer"], label)
+        seconds = sum(timer["sum"] for timer in timers)
+        if source["counter"]:
+            count = sum(counter["value"] for counter in _matching(stage_metrics["counters"], source["counter"], label))
+        else:
+            count = sum(timer["count"] for timer in timers)
+        if count and seconds:
+            return seconds / count
+    return None
+
+
+def _benchmark_rate(benchmarks, source, label):
+    if "benchmark" not in source:
+        return None
+    template, param = source["benchmark"]
+    name = template.format(label=label)
+    runs = [run for run in benchmarks if run["name"] == name and (run["params"].get(param) if param else run["units"])]
+    if not runs:
+        return None
+    # The largest scale says the most about large runs.
+    run = max(runs, key=lambda run: run["params"][param] if param else run["units"])
+    units = run["params"][param] if param else run["units"]
+    return run["seconds"] / units
+
+
+def estimate_runtime(stage, work, history, benchmarks):
+    """Returns (seconds, where the rates came from) for a stage's planned work. Seconds is None if some work has no estimate."""
+    seconds = 0.0
+    origins = set()
+    for unit, counts in work.items():
+        source = RUNTIME_SOURCES[stage][unit]
+        for label, count in (counts.items() if isinstance(counts, dict) else [(None, counts)]):
+            if not count:
+                continue
+            for origin, rate in (("history", _history_rate(history, stage, source, label)),
+                                 ("benchmarks", _benchmark_rate(benchmarks, source, label)),
+                                 ("assumed", source.get("default"))):
+                if rate is not None:
+                    break
+            else:
+                return None, sorted(origins)
+            seconds += rate * count
+            origins.add(origin)
+    return seconds, sorted(origins)
+
+
+def _history_bytes_per_file(history, stage, label):
+    for stage_metrics in _stage_metrics(history, stage):
+        files = sum(counter["value"] for counter in _matching(stage_metrics["counters"], f"{stage}_files_written", label))
+        if files:
+            written = sum(counter["value"] for counter in _matching(stage_metrics["counters"], f"{stage}_bytes_written", label))
+            return written / files
+    return None
+
+
+def estimate_output_bytes(stage, outputs, history):
+    """Returns the bytes a stage's planned outputs will take, using the file sizes of the last run that wrote any."""
+    total = 0
+    for label, output in outputs.items():
+        per_file = _history_bytes_per_file(history, stage, label)
+        total += round(output["files"] * per_file) if per_file is not None else output["bytes"]
+    return total
+
+
+def _history_tokens_per_call(history, stage, model, kind):
+    for stage_metrics in _stage_metrics(history, stage):
+        calls = sum(timer["count"] for timer in _matching(stage_metrics["histograms"], f"{stage}_llm_latency_seconds", model))
+        tokens = _matching(stage_metrics["counters"], f"{stage}_llm_{kind}_tokens", model)
+        if calls and tokens:
+            return sum(counter["value"] for counter in tokens) / calls
+    return None
+
+
+def _related(name, other, dependencies):
+    """True if one of the two stages waits, directly or not, for the other."""
+    def ancestors(stage):
+        found = set()
+        pending = list(dependencies.get(stage, []))
+        while pending:
+            dep = pending.pop()
+            if dep not in found:
+                found.add(dep)
+                pending.extend(dependencies.get(dep, []))
+        return found
+    return other in ancestors(name) or name in ancestors(other)
+
+
+def _wall_seconds(stages, dependencies, sequential):
+    if any(stage["seconds"] is None for stage in stages.values()):
+        return None
+    if sequential:
+        return sum(stage["seconds"] for stage in stages.values())
+    finish = {}
+
+    def finish_time(name):
+        if name not in finish:
+            start = max((finish_time(dep) for dep in dependencies.get(name, []) if dep in stages), default=0.0)
+            finish[name] = start + stages[name]["seconds"]
+        return finish[name]
+
+    return max((finish_time(name) for name in stages), default=0.0)
+
+
+def _peak_memory_mb(stages, dependencies, sequential):
+    """The most memory the stages that can run at once need together, counting the BASE_MEMORY_MB they share once."""
+    def extra(name):
+        return stages[name]["peak_memory_mb"] - BASE_MEMORY_MB
+
+    names = list(stages)
+    if sequential:
+        return BASE_MEMORY_MB + max((extra(name) for name in names), default=0)
+    peak = 0
+    for size in range(1, len(names) + 1):
+        for group in itertools.combinations(names, size):
+            if not any(_related(a, b, dependencies) for a, b in itertools.combinations(group, 2)):
+                peak = max(peak, sum(extra(name) for name in group))
+    return BASE_MEMORY_MB + peak
+
+
+def build_plan(config, stage_plans, dependencies, sequential=False):
+    """Estimates a run's cost from each stage's plan_* result (jobs, work, api_calls, tokens, outputs, memory_bytes, notes)."""
+    history = load_run_history(get_config_value(config, "report_history_path", "output/run_history.jsonl"))
+    benchmarks = load_benchmark_results(get_config_value(config, "benchmark_results", DEFAULT_BENCHMARK_RESULTS))
+
+    stages = {}
+    for name, stage_plan in stage_plans.items():
+        seconds, origins = estimate_runtime(name, stage_plan.get("work", {}), history, benchmarks)
+        api_calls = stage_plan.get("api_calls", {})
+        tokens = {}
+        for model, counts in stage_plan.get("tokens", {}).items():
+            per_call = _history_tokens_per_call(history, name, model, "output")
+            tokens[model] = dict(counts, output=round(per_call * api_calls[model])) if per_call is not None else dict(counts)
+        outputs = stage_plan.get("outputs", {})
+        stages[name] = {
+            "jobs": stage_plan.get("jobs", {}),
+            "api_calls": api_calls,
+            "tokens": tokens,
+            "seconds": seconds,
+            "runtime_from": origins,
+            "output_files": sum(output["files"] for output in outputs.values()),
+            "output_bytes": estimate_output_bytes(name, outputs, history),
+            "peak_memory_mb": BASE_MEMORY_MB + stage_plan.get("memory_bytes", 0) / 2 ** 20,
+            "notes": stage_plan.get("notes", []),
+        }
+
+    api_calls = {}
+    tokens = {}
+    for stage in stages.values():
+        for model, count in stage["api_calls"].items():
+            api_calls[model] = api_calls.get(model, 0) + count
+        for model, counts in stage["tokens"].items():
+            total = tokens.setdefault(model, {"input": 0, "output": 0})
+            for kind in total:
+                total[kind] += counts.get(kind, 0)
+    return {
+        "stages": stages,
+        "api_calls": api_calls,
+        "tokens": tokens,
+        "output_files": sum(stage["output_files"] for stage in stages.values()),
+        "output_bytes": sum(stage["output_bytes"] for stage in stages.values()),
+        "peak_memory_mb": _peak_memory_mb(stages, dependencies, sequential),
+        "wall_seconds": _wall_seconds(stages, dependencies, sequential),
+    }
+
+
+def _over_limit(problems, what, values, limit):
+    """Checks per-model values against a limit that is either a total or a {model: limit} map."""
+    if limit is None:
+        return
+    if isinstance(limit, dict):
+        for model, model_limit in limit.items():
+            if values.get(model, 0) > model_limit:
+                problems.append(f"{what} for {model}: {values[model]:,} planned, the budget is {model_limit:,}.")
+    elif sum(values.values()) > limit:
+        problems.append(f"{what}: {sum(values.values()):,} planned, the budget is {limit:,}.")
+
+
+def check_budgets(plan, config):
+    """Returns the ways a plan exceeds the config's budgets and stage memory limits (empty if none)."""
+    budgets = config.get("budgets", {})
+    problems = []
+    _over_limit(problems, "API calls", plan["api_calls"], get_config_value(budgets, "max_api_calls"))
+    _over_limit(problems, "Tokens", {model: counts["input"] + counts["output"] for model, counts in plan["tokens"].items()},
+                get_config_value(budgets, "max_tokens"))
+
+    max_runtime_minutes = get_config_value(budgets, "max_runtime_minutes")
+    if max_runtime_minutes is not None:
+        if plan["wall_seconds"] is None:
+            problems.append("The runtime budget cannot be checked: no run history or benchmark results measure this work. "
+                            "Run benchmarks/run_benchmarks.py or a smaller run first.")
+        elif plan["wall_seconds"] > max_runtime_minutes * 60:
+            problems.append(f"Runtime: about {format_seconds(plan['wall_seconds'])} planned, the budget is {max_runtime_minutes} minutes.")
+
+    max_output_gb = get_config_value(budgets, "max_output_gb")
+    if max_output_gb is not None and plan["output_bytes"] > max_output_gb * 1e9:
+        problems.append(f"Output: about {format_bytes(plan['output_bytes'])} planned, the budget is {max_output_gb:g} GB.")
+
+    max_memory_mb = get_config_value(budgets, "max_memory_mb")
+    if max_memory_mb is not None and plan["peak_memory_mb"] > max_memory_mb:
+        problems.append(f"Memory: about {plan['peak_memory_mb']:,.0f} MB at peak, the budget is {max_memory_mb:,} MB.")
+    for name, stage in plan["stages"].items():
+        stage_limit = get_config_value(config.get(name, {}), "max_memory_mb")
+        if stage_limit is not None and stage["peak_memory_mb"] > stage_limit:
+            problems.append(f"{name}: needs about {stage['peak_memory_mb']:,.0f} MB, more than its max_memory_mb of {stage_limit:,}.")
+    return problems
+
+
+def format_seconds(seconds):
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours < 1:
+        return f"{minutes}m {seconds:02d}s"
+    if hours < 48:
+        return f"{hours}h {minutes:02d}m"
+    return f"{hours // 24}d {hours % 24:02d}h"
+
+
+def format_bytes(size):
+    for unit, scale in (("GB", 1e9), ("MB", 1e6), ("KB", 1e3)):
+        if size >= scale:
+            return f"{size / scale:.1f} {unit}"
+    return f"{size} bytes"
+
+
+def format_tokens(count):
+    for unit, scale in (("B", 1e9), ("M", 1e6), ("K", 1e3)):
+        if count >= scale:
+            return f"{count / scale:.1f}{unit}"
+    return str(count)
+
+
+def format_plan(plan):
+    """Returns the lines of a human-readable plan."""
+    lines = []
+    for name, stage in plan["stages"].items():
+        jobs = ", ".join(f"{count:,} {job}" for job, count in stage["jobs"].items())
+        lines.append(f"{name}: {jobs}")
+        for model, calls in stage["api_calls"].items():
+            counts = stage["tokens"].get(model, {})
+            lines.append(f"    {model}: {calls:,} calls, ~{format_tokens(counts.get('input', 0))} input and "
+                         f"~{format_tokens(counts.get('output', 0))} output tokens")
+        if stage["seconds"] is None:
+            runtime = "runtime unknown"
+        else:
+            runtime = f"runtime ~{format_seconds(stage['seconds'])} ({', '.join(stage['runtime_from'])})"
+        lines.append(f"    {runtime}, {stage['output_files']:,} files of ~{format_bytes(stage['output_bytes'])}, "
+                     f"peak memory ~{stage['peak_memory_mb']:,.0f} MB")
+        for note in stage["notes"]:
+            lines.append(f"    Note: {note}")
+
+    calls = sum(plan["api_calls"].values())
+    tokens = sum(counts["input"] + counts["output"] for counts in plan["tokens"].values())
+    wall = "unknown" if plan["wall_seconds"] is None else f"~{format_seconds(plan['wall_seconds'])}"
+    lines.append(f"Total: {calls:,} API calls, ~{format_tokens(tokens)} tokens, {plan['output_files']:,} files of "
+                 f"~{format_bytes(plan['output_bytes'])}, peak memory ~{plan['peak_memory_mb']:,.0f} MB, wall time {wall}")
+    if plan["wall_seconds"] is None:
+        lines.append("Some runtimes are unknown. Run benchmarks/run_benchmarks.py, or a smaller run, to measure them.")
+    return lines
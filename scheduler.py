@@ -0,0 +1,272 @@
+import os
+import pickle
+import sys
+import threading
+import time
+import traceback
+
+# Default number of stages that may hold each kind of resource at once.
+DEFAULT_RESOURCE_LIMITS = {"cpu": os.cpu_count() or 1, "disk": 1, "network": 1}
+
+SKIPPED = "skipped"
+
+# Held while forking so that no other stage's pipe write end (or a half-written line) leaks into the child.
+_fork_lock = threading.Lock()
+
+
+class Stage:
+    """A generator stage: a callable to run, the resource it leans on and the stages it waits for.
+
+    After run_stages returns, `result` holds whatever the callable returned and
+    `duration` how many seconds it ran for (None if it never started).
+    """
+
+    def __init__(self, name, target, args=(), kwargs=None, resource="cpu", depends_on=(), nice=None, max_memory_mb=None):
+        self.name = name
+        self.target = target
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.resource = resource
+        self.depends_on = list(depends_on)
+        self.nice = nice
+        self.max_memory_mb = max_memory_mb
+        self.result = None
+        self.duration = None
+
+
+def _apply_limits(stage):
+    """Applies the stage's nice level and memory limit to the current (child) process."""
+    if stage.nice is not None:
+        os.nice(stage.nice)
+    if stage.max_memory_mb is not None:
+        import resource
+        limit = int(stage.max_memory_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _exit_code(exc):
+    """Maps a SystemExit to the process exit code it would have produced."""
+    if exc.code is None:
+        return 0
+    if isinstance(exc.code, int):
+        return exc.code
+    print(exc.code, file=sys.stderr)
+    return 1
+
+
+def _run_in_child(stage, output_fd, result_fd):
+    """Runs the stage target in a forked child, sending output and the pickled result to the parent."""
+    os.dup2(output_fd, 1)
+    os.dup2(output_fd, 2)
+    os.close(output_fd)
+    sys.stdout = open(1, "w", buffering=1, errors="replace", closefd=False)
+    sys.stderr = open(2, "w", buffering=1, errors="replace", closefd=False)
+
+    code = 0
+    result = None
+    try:
+        _apply_limits(stage)
+        result = stage.target(*stage.args, **stage.kwargs)
+    except SystemExit as e:
+        code = _exit_code(e)
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+
+    try:
+        payload = pickle.dumps(result)
+    except Exception as e:
+        print(f"Could not return the stage result: {e}", file=sys.stderr)
+        payload = pickle.dumps(None)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # Closing the output pipe tells the parent we are done printing before the result is sent.
+    os.close(1)
+    os.close(2)
+    with os.fdopen(result_fd, "wb") as f:
+        f.write(payload)
+    os._exit(code)
+
+
+def _run_forked(stage, emit, print_lock):
+    """Runs a stage in a forked child, streaming its output through emit. Returns the exit code."""
+    with print_lock, _fork_lock:
+        output_r, output_w = os.pipe()
+        result_r, result_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(output_r)
+            os.close(result_r)
+            _run_in_child(stage, output_w, result_w)
+        os.close(output_w)
+        os.close(result_w)
+
+    with os.fdopen(output_r, "r", errors="replace") as output:
+        for line in output:
+            emit(stage.name, line.rstrip("\n"))
+    with os.fdopen(result_r, "rb") as f:
+        payload = f.read()
+    _, status = os.waitpid(pid, 0)
+    if payload:
+        stage.result = pickle.loads(payload)
+    return os.waitstatus_to_exitcode(status)
+
+
+class _StageOutput:
+    """A stdout/stderr stand-in that prefixes each line with the name of the stage writing it."""
+
+    def __init__(self, emit, stream):
+        self.emit = emit
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        name = getattr(self.local, "name", None)
+        if name is None:
+            return self.stream.write(text)
+        buffered = getattr(self.local, "buffer", "") + text
+        *lines, self.local.buffer = buffered.split("\n")
+        for line in lines:
+            self.emit(name, line)
+        return len(text)
+
+    def flush(self):
+        name = getattr(self.local, "name", None)
+        if name is not None and getattr(self.local, "buffer", ""):
+            self.emit(name, self.local.buffer)
+            self.local.buffer = ""
+        self.stream.flush()
+
+
+def _run_in_thread(stage, output):
+    """Runs a stage on the current thread, where fork is unavailable or not wanted. Limits are not applied."""
+    output.local.name = stage.name
+    try:
+        stage.result = stage.target(*stage.args, **stage.kwargs)
+        return 0
+    except SystemExit as e:
+        return _exit_code(e)
+    except Exception:
+        traceback.print_exc(file=output)
+        return 1
+    finally:
+        output.flush()
+        output.local.name = None
+
+
+def _check_graph(stages):
+    """Rejects unknown dependencies and cycles before anything is started."""
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for dep in stage.depends_on:
+            if dep not in by_name:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'.")
+
+    visiting, done = set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Stage dependency cycle involving '{name}'.")
+        visiting.add(name)
+        for dep in by_name[name].depends_on:
+            visit(dep)
+        visiting.remove(name)
+        done.add(name)
+
+    for stage in stages:
+        visit(stage.name)
+
+
+def run_stages(stages, resource_limits=None, max_parallel=None, emit=None, on_finish=None, fork=None):
+    """Runs stages concurrently as a DAG and returns a dict of stage name to exit code.
+
+    Each stage runs in a forked child of this process, so already-imported modules are
+    reused and no arguments need to be serialized. A stage starts once all of its
+    dependencies have exited with 0 and a slot is free for its resource; stages whose
+    dependencies failed are not run and report SKIPPED. Each output line is printed
+    prefixed with the stage name.
+
+    emit(name, line) replaces the printing of output lines, and on_finish(stage, code) is
+    called as each stage exits. With fork=False, stages run on threads of this process
+    instead, so anything they cache in memory outlives the run.
+    """
+    _check_graph(stages)
+    limits = dict(DEFAULT_RESOURCE_LIMITS)
+    limits.update(resource_limits or {})
+    semaphores = {}
+    for stage in stages:
+        if stage.resource not in semaphores:
+            semaphores[stage.resource] = threading.BoundedSemaphore(max(1, int(limits.get(stage.resource, 1))))
+    parallel = threading.BoundedSemaphore(max_parallel or len(stages) or 1)
+
+    finished = {stage.name: threading.Event() for stage in stages}
+    results = {}
+    print_lock = threading.Lock()
+    width = max((len(stage.name) for stage in stages), default=0)
+    can_fork = hasattr(os, "fork") if fork is None else fork and hasattr(os, "fork")
+    stream = sys.stdout
+
+    if emit is None:
+        def emit(name, line):
+            with print_lock:
+                stream.write(f"[{name:<{width}}] {line}\n")
+                stream.flush()
+
+    output = None if can_fork else _StageOutput(emit, stream)
+
+    def run(stage):
+        try:
+            for dep in stage.depends_on:
+                finished[dep].wait()
+            failed = [dep for dep in stage.depends_on if results.get(dep) != 0]
+            if failed:
+                emit(stage.name, f"Skipped because {', '.join(failed)} did not succeed.")
+                results[stage.name] = SKIPPED
+                if on_finish:
+                    on_finish(stage, SKIPPED)
+                return
+
+            with semaphores[stage.resource], parallel:
+                emit(stage.name, f"Starting ({stage.resource}-bound)")
+                start = time.monotonic()
+                if can_fork:
+                    results[stage.name] = _run_forked(stage, emit, print_lock)
+                else:
+                    results[stage.name] = _run_in_thread(stage, output)
+                stage.duration = time.monotonic() - start
+                emit(stage.name, f"Exited with code {results[stage.name]} after {stage.duration:.1f}s")
+            if on_finish:
+                on_finish(stage, results[stage.name])
+        finally:
+            finished[stage.name].set()
+
+    saved_streams = sys.stdout, sys.stderr
+    if output is not None:
+        sys.stdout = sys.stderr = output
+    try:
+        threads = [threading.Thread(target=run, args=(stage,), name=f"stage-{stage.name}") for stage in stages]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.stdout, sys.stderr = saved_streams
+    return results
+
+
+def summarize_results(results):
+    """Returns (overall exit code, human-readable summary lines) for a run_stages result."""
+    lines = []
+    exit_code = 0
+    for name, code in results.items():
+        if code == 0:
+            lines.append(f"  {name}: ok")
+        elif code == SKIPPED:
+            lines.append(f"  {name}: skipped")
+            exit_code = exit_code or 1
+        else:
+            lines.append(f"  {name}: failed (exit code {code})")
+            exit_code = exit_code or (code if isinstance(code, int) and code > 0 else 1)
+    return exit_code, lines
@@ -0,0 +1,155 @@
+import glob
+import hashlib
+import os
+
+from manifest import Manifest
+from orgconfig import get_config_value
+
+
+def shard_of(key, count):
+    """Returns the shard (0 to count - 1) a key belongs to. Stable across machines and Python runs."""
+    digest = hashlib.sha256(str(key).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+class Shard:
+    """One of `count` shards of a run. Written and parsed as "i/N", counting from 1."""
+
+    def __init__(self, index, count):
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"Invalid shard {index + 1}/{count}: expected 1/N to N/N.")
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, spec):
+        try:
+            number, count = (int(part) for part in str(spec).split("/"))
+        except ValueError:
+            raise ValueError(f"Invalid shard '{spec}': expected i/N, such as 2/8.") from None
+        return cls(number - 1, count)
+
+    def __str__(self):
+        return f"{self.index + 1}/{self.count}"
+
+    def __eq__(self, other):
+        return isinstance(other, Shard) and (self.index, self.count) == (other.index, other.count)
+
+    def owns(self, key):
+        """True if this shard generates the artifacts for key, usually a user key."""
+        return shard_of(key, self.count) == self.index
+
+    def dirname(self):
+        """The name of this shard's manifest directory, under manifest_dir."""
+        return f"shard-{self.index + 1}-of-{self.count}"
+
+
+def get_shard(config):
+    """Returns the Shard set by the config's "shard" value (e.g. "2/8"), or None if the run is not sharded."""
+    spec = get_config_value(config, "shard")
+    return Shard.parse(spec) if spec else None
+
+
+def shard_summary(shard, outputs, total):
+    """The inputs recorded on a stage's summary entry, which the merge step checks the shards against."""
+    return {"shard": str(shard) if shard else None, "outputs": outputs, "total": total}
+
+
+def find_shard_manifest_dirs(manifest_dir):
+    return sorted(glob.glob(os.path.join(manifest_dir, "shard-*-of-*")))
+
+
+def _load_shard(manifest_dir):
+    manifests = {}
+    for path in sorted(glob.glob(os.path.join(manifest_dir, "*.jsonl"))):
+        stage = os.path.splitext(os.path.basename(path))[0]
+        manifests[stage] = Manifest(path, read_only=True)
+    return manifests
+
+
+def verify_shards(manifest_dirs):
+    """Checks that the manifests of a sharded run union into a complete, non-overlapping dataset.
+
+    Every shard from 1/N to N/N must be present exactly once, and every stage must have
+    been generated from the same config and seed on each shard. A stage's summary entry
+    lists the artifacts its shard owns and the total across all shards; these must be
+    disjoint, generated successfully and add up to the total. Stages without a summary
+    entry (like org) are replicated, so their artifacts must be identical on every shard.
+
+    Returns a list of problems (empty if the shards merge cleanly) and per-stage artifact counts.
+    """
+    problems = []
+    shards = {}
+    for manifest_dir in manifest_dirs:
+        manifests = _load_shard(manifest_dir)
+        specs = {m.meta.get("shard") for m in manifests.values()}
+        if len(specs) != 1 or None in specs:
+            problems.append(f"{manifest_dir}: not the manifest of a single shard (found {sorted(map(str, specs))}).")
+            continue
+        shard = Shard.parse(specs.pop())
+        if str(shard) in shards:
+            problems.append(f"{manifest_dir}: shard {shard} is also in {shards[str(shard)][0]}.")
+            continue
+        shards[str(shard)] = (manifest_dir, shard, manifests)
+
+    counts = {shard.count for _, shard, _ in shards.values()}
+    if len(counts) > 1:
+        problems.append(f"The shards disagree on the number of shards: {sorted(counts)}.")
+        return problems, {}
+    if not shards:
+        problems.append("No shard manifests found.")
+        return problems, {}
+    count = counts.pop()
+    missing = [f"{i + 1}/{count}" for i in range(count) if f"{i + 1}/{count}" not in shards]
+    if missing:
+        problems.append(f"Missing shards: {', '.join(missing)}.")
+
+    totals = {}
+    stages = sorted({stage for _, _, manifests in shards.values() for stage in manifests})
+    for stage in stages:
+        present = [(manifest_dir, shard, manifests[stage]) for manifest_dir, shard, manifests in shards.values() if stage in manifests]
+        if len(present) != len(shards):
+            problems.append(f"{stage}: only {len(present)} of {len(shards)} shards have a manifest.")
+        if len({m.meta.get("seed") for _, _, m in present}) > 1:
+            problems.append(f"{stage}: the shards used different seeds.")
+
+        summaries = [(shard, m.get(stage)) for _, shard, m in present if m.get(stage)]
+        if not summaries:
+            # A replicated stage: every shard must hold the same artifacts.
+            reference = {entry_id: entry.get("checksum") for entry_id, entry in present[0][2].entries.items()}
+            for _, shard, m in present[1:]:
+                if {entry_id: entry.get("checksum") for entry_id, entry in m.entries.items()} != reference:
+                    problems.append(f"{stage}: shard {shard} differs from shard {present[0][1]}.")
+            totals[stage] = len(reference)
+            continue
+
+        if len(summaries) != len(present):
+            problems.append(f"{stage}: some shards have no summary entry; the stage did not finish there.")
+        if len({entry["config_hash"] for _, entry in summaries}) > 1:
+            problems.append(f"{stage}: the shards were generated from different configs.")
+        expected_totals = {entry["inputs"].get("total") for _, entry in summaries}
+        if len(expected_totals) > 1:
+            problems.append(f"{stage}: the shards disagree on the total number of artifacts: {sorted(expected_totals)}.")
+
+        owners = {}
+        for _, shard, m in present:
+            summary = m.get(stage)
+            if not summary:
+                continue
+            if summary.get("status") != "ok" or summary["inputs"].get("shard") != str(shard):
+                problems.append(f"{stage}: shard {shard} did not finish.")
+            for artifact_id in summary["inputs"].get("outputs", []):
+                if artifact_id in owners:
+                    problems.append(f"{stage}: {artifact_id} was generated by both shard {owners[artifact_id]} and shard {shard}.")
+                    continue
+                owners[artifact_id] = shard
+                entry = m.get(artifact_id)
+                if not entry or entry.get("status") != "ok":
+                    problems.append(f"{stage}: {artifact_id} is missing or failed on shard {shard}.")
+
+        total = expected_totals.pop() if len(expected_totals) == 1 else None
+        if total is not None and len(owners) != total:
+            problems.append(f"{stage}: the shards generated {len(owners)} artifacts, expected {total}.")
+        totals[stage] = len(owners)
+
+    return problems, totals
@@ -0,0 +1,271 @@
+import argparse
+import itertools
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from contextlib import redirect_stdout
+
+from generate_all import GENERATORS, load_generator_module, run_generation
+from orgconfig import get_config_value, load_config
+from sharding import Shard
+
+DEFAULT_SOCKET = "output/.worker.sock"
+
+# Jobs run one at a time: generators print to the process-wide stdout, record into the
+# process-wide metrics registry and resolve relative paths against the working directory.
+_job_lock = threading.Lock()
+_job_ids = itertools.count(1)
+
+
+def preload(api_key=None, corpus_paths=()):
+    """Imports every generator and warms what jobs reuse: templates, Gemini clients and corpus indexes.
+
+    Returns the names of the generators that could be loaded.
+    """
+    loaded = []
+    for name in GENERATORS:
+        try:
+            load_generator_module(name)
+            loaded.append(name)
+        except ImportError as e:
+            print(f"Could not preload the {name} generator: {e}")
+
+    if "docs" in loaded:
+        docs = load_generator_module("docs")
+        # The office libraries import most of their parts on first use.
+        docs.Document()
+        docs.Presentation()
+        docs.FPDF()
+        if api_key:
+            docs.get_client(api_key)
+    if "email" in loaded:
+        email = load_generator_module("email")
+        for path in corpus_paths:
+            index = email.cache_corpus_index(path)
+            print(f"Indexed {index.num_rows} rows of {path}")
+    return loaded
+
+
+class _JobConnection:
+    """Sends a job's events to the client as JSON lines. Also a stdout stand-in that sends "log" events."""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.lock = threading.Lock()
+        self.buffer = ""
+        self.connected = True
+
+    def send(self, event, **fields):
+        with self.lock:
+            if not self.connected:
+                return
+            try:
+                self.wfile.write((json.dumps({"event": event, **fields}, default=str) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            except OSError:
+                # The client went away; the job still runs to completion.
+                self.connected = False
+
+    def write(self, text):
+        *lines, self.buffer = (self.buffer + text).split("\n")
+        for line in lines:
+            self.send("log", line=line)
+        return len(text)
+
+    def flush(self):
+        if self.buffer:
+            self.send("log", line=self.buffer)
+            self.buffer = ""
+
+
+def parse_job(spec):
+    """Returns (config, options) for a job spec.
+
+    A spec is a config in the config.json format, either on its own, under "config", or
+    as a "config_path" to load. The options "force", "sequential", "shard" and "cwd"
+    mirror generate_all.py's arguments and working directory.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("A job spec must be a JSON object.")
+    options = {key: spec.get(key) for key in ("force", "sequential", "shard", "cwd")}
+    if "config_path" in spec:
+        path = os.path.join(options["cwd"] or "", spec["config_path"])
+        if not os.path.exists(path):
+            raise ValueError(f"Config file not found at {path}")
+        config = load_config(path)
+    elif "config" in spec:
+        config = spec["config"]
+    else:
+        config = {key: value for key, value in spec.items() if key not in options}
+    if not isinstance(config, dict):
+        raise ValueError("The job's config must be a JSON object.")
+    return config, options
+
+
+def run_job(config, options, connection):
+    """Runs one job in this process, streaming its progress and artifacts. Returns the exit code."""
+    def emit(name, line):
+        connection.send("progress", stage=name, line=line)
+
+    def on_finish(stage, exit_code):
+        for path in (stage.result or {}).get("artifacts") or []:
+            connection.send("artifact", stage=stage.name, path=path)
+        connection.send("stage", stage=stage.name, exit_code=exit_code, duration_seconds=stage.duration)
+
+    if "email" in config:
+        # Scan the source CSV once; later jobs sample it through the in-memory index.
+        email = load_generator_module("email")
+        source_csv = get_config_value(config["email"], "source_csv", email.DEFAULT_SOURCE_CSV)
+        if os.path.exists(source_csv):
+            email.cache_corpus_index(source_csv)
+
+    shard = Shard.parse(options["shard"]) if options["shard"] else None
+    exit_code, report = run_generation(
+        config, force=bool(options["force"]), sequential=bool(options["sequential"]), shard=shard,
+        emit=emit, on_finish=on_finish, fork=False,
+    )
+    connection.send("report", report=report)
+    return exit_code
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        connection = _JobConnection(self.wfile)
+        job_id = next(_job_ids)
+        start = time.monotonic()
+        exit_code = 1
+        try:
+            config, options = parse_job(json.loads(self.rfile.readline()))
+        except (ValueError, OSError) as e:
+            connection.send("error", job=job_id, message=str(e))
+            connection.send("done", job=job_id, exit_code=exit_code, seconds=time.monotonic() - start)
+            return
+
+        connection.send("accepted", job=job_id)
+        if _job_lock.locked():
+            connection.send("queued", job=job_id)
+        with _job_lock:
+            cwd = os.getcwd()
+            try:
+                if options["cwd"]:
+                    os.chdir(options["cwd"])
+                with redirect_stdout(connection):
+                    exit_code = run_job(config, options, connection)
+            except (ValueError, ImportError, OSError) as e:
+                connection.send("error", job=job_id, message=str(e))
+            except Exception:
+                connection.send("error", job=job_id, message=traceback.format_exc())
+            finally:
+                connection.flush()
+                os.chdir(cwd)
+        seconds = time.monotonic() - start
+        # Another job may already have redirected sys.stdout to its client.
+        print(f"Job {job_id} finished with exit code {exit_code} in {seconds:.3f}s", file=sys.__stdout__, flush=True)
+        connection.send("done", job=job_id, exit_code=exit_code, seconds=seconds)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path, api_key=None, corpus_paths=()):
+    """Preloads everything and serves jobs on a Unix socket until interrupted."""
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            raise ValueError(f"A worker is already listening on {socket_path}.")
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(socket_path)  # Left behind by a worker that did not shut down cleanly.
+        finally:
+            probe.close()
+    os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+
+    start = time.monotonic()
+    loaded = preload(api_key=api_key, corpus_paths=corpus_paths)
+    print(f"Preloaded {', '.join(loaded) or 'no generators'} in {time.monotonic() - start:.1f}s")
+
+    server = _Server(socket_path, _JobHandler)
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    print(f"Listening on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def submit(socket_path, spec, raw=False):
+    """Sends a job to a running worker, prints its events as they arrive and returns the job's exit code."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        raise ValueError(f"No worker is listening on {socket_path}. Start one with: python3 worker_daemon.py serve") from None
+
+    exit_code = 1
+    with client, client.makefile("rwb") as stream:
+        stream.write((json.dumps(spec) + "\n").encode("utf-8"))
+        stream.flush()
+        for line in stream:
+            event = json.loads(line)
+            if raw:
+                print(json.dumps(event))
+            elif event["event"] == "progress":
+                print(f"[{event['stage']}] {event['line']}")
+            elif event["event"] == "log":
+                print(event["line"])
+            elif event["event"] == "error":
+                print(f"Error: {event['message']}")
+            elif event["event"] == "queued":
+                print("Waiting for the worker to finish another job...")
+            if event["event"] == "done":
+                exit_code = event["exit_code"]
+                if not raw:
+                    print(f"Job {event['job']} finished in {event['seconds']:.3f}s")
+    return exit_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="A long-running worker that keeps the generators loaded and runs generation jobs sent to it.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--socket", default=DEFAULT_SOCKET, help=f"Path of the Unix socket (default {DEFAULT_SOCKET}).")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", parents=[common], help="Start the worker.")
+    serve_parser.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY"), help="Gemini API key to create a client for up front.")
+    serve_parser.add_argument("--index-csv", nargs="*", default=[], help="Email source CSV files to index up front.")
+
+    submit_parser = commands.add_parser("submit", parents=[common], help="Run a job on a running worker.")
+    submit_parser.add_argument("--config", default="config.json", help="Path to the configuration file.")
+    submit_parser.add_argument("--sequential", action="store_true", help="Run one stage at a time instead of concurrently.")
+    submit_parser.add_argument("--force", action="store_true", help="Ignore the manifest and regenerate every artifact.")
+    submit_parser.add_argument("--shard", help="Generate only one shard of the users' data, e.g. 2/8.")
+    submit_parser.add_argument("--json", action="store_true", help="Print the raw JSON events.")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "serve":
+            serve(args.socket, api_key=args.api_key, corpus_paths=args.index_csv)
+        else:
+            spec = {
+                "config_path": os.path.abspath(args.config), "cwd": os.getcwd(),
+                "force": args.force, "sequential": args.sequential, "shard": args.shard,
+            }
+            sys.exit(submit(args.socket, spec, raw=args.json))
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()